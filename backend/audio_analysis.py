@@ -0,0 +1,401 @@
+"""librosa music analysis, run in worker processes.
+
+Audio is decoded by audio_decode (an FFmpeg pipe at ANALYSIS_SAMPLE_RATE).
+
+Everything here is a top-level function so it can be sent to a
+ProcessPoolExecutor. The module does not import main.py (FastAPI, Gemini),
+so spawned workers start quickly; warm_up() is the pool initializer that
+imports librosa and triggers numba's JIT compilation once per worker
+instead of on the first request it serves.
+"""
+import signal
+from typing import Any, Dict, List, Optional
+
+import segmentation
+import waveform
+from audio_decode import ANALYSIS_SAMPLE_RATE, decode_audio, probe_duration, stream_audio
+
+ANALYSIS_SECONDS = 60  # Preview mode only analyzes the start of the track
+
+# librosa's defaults, so the shared arrays match what each feature would
+# compute from the signal on its own
+N_FFT = 2048
+HOP_LENGTH = 512
+
+# Streaming (full-track) analysis: STFT frames per decoded block (~6s at
+# 22.05kHz), the tempogram window and onset_detect's peak-picking windows
+STREAM_BLOCK_FRAMES = 256
+TEMPOGRAM_WINDOW = 384
+ONSET_MAX_SECONDS = 0.03
+ONSET_AVG_SECONDS = 0.1
+ONSET_WAIT_SECONDS = 0.03
+ONSET_DELTA = 0.07
+TOP_DB = 80.0
+
+
+def warm_up() -> None:
+    """Pool initializer: import librosa and compile its numba kernels on a short signal"""
+    try:
+        import librosa
+        import numpy as np
+    except ImportError:
+        return  # analyze_music falls back to the basic analysis
+
+    sr = 22050
+    t = np.arange(sr * 2) / sr
+    y = (np.sin(2 * np.pi * 220 * t) * (t % 0.5 < 0.1)).astype(np.float32)
+    try:
+        extract_features(y, sr)
+    except Exception as e:
+        # An initializer error breaks the whole pool; let the real task report it instead
+        print(f"⚠️  Music analysis warm-up failed: {str(e)}")
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError("Music analysis timed out")
+
+
+def run_with_timeout(timeout: float, function, *args):
+    """Call function in this worker, aborting it after timeout seconds.
+
+    Uses SIGALRM, so the worker is freed for the next task; where that is not
+    available the caller's own timeout is the only limit.
+    """
+    if not hasattr(signal, "SIGALRM"):
+        return function(*args)
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return function(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def describe_music(tempo: float, energy_level: float) -> Dict[str, str]:
+    """Mood, genre and energy labels from tempo and mean RMS"""
+    if tempo > 140:
+        mood = "energetic and upbeat"
+        genre = "electronic/dance"
+    elif tempo > 120:
+        mood = "lively and positive"
+        genre = "pop/rock"
+    elif tempo > 90:
+        mood = "moderate and balanced"
+        genre = "indie/alternative"
+    else:
+        mood = "calm and relaxed"
+        genre = "ambient/chill"
+
+    if energy_level > 0.1:
+        energy = "high energy"
+    elif energy_level > 0.05:
+        energy = "medium energy"
+    else:
+        energy = "low energy"
+    return {"mood": mood, "genre": genre, "energy": energy}
+
+
+def extract_features(y, sr: int) -> Dict[str, Any]:
+    """Tempo, beats, onsets, RMS, spectral centroid and chroma from a single STFT.
+
+    The magnitude spectrogram is computed once; the onset envelope comes from
+    its mel power spectrogram and feeds both the beat tracker and the onset
+    detector, and RMS/centroid/chroma are read off the same frames. Calling each
+    librosa feature on y instead computes three STFTs and two onset envelopes.
+    """
+    import librosa
+    import numpy as np
+
+    S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    mel = librosa.feature.melspectrogram(S=S ** 2, sr=sr)
+    onset_envelope = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=sr, hop_length=HOP_LENGTH)
+
+    tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr, hop_length=HOP_LENGTH)
+    onset_frames = librosa.onset.onset_detect(onset_envelope=onset_envelope, sr=sr, hop_length=HOP_LENGTH)
+
+    # RMS from S sees the Hann window; rescale it to the unwindowed frame RMS
+    window = librosa.filters.get_window("hann", N_FFT, fftbins=True)
+    rms = librosa.feature.rms(S=S, frame_length=N_FFT, hop_length=HOP_LENGTH)[0] / np.sqrt(np.mean(window ** 2))
+    centroid = librosa.feature.spectral_centroid(S=S, sr=sr, n_fft=N_FFT, hop_length=HOP_LENGTH)[0]
+    chroma = librosa.feature.chroma_stft(S=S ** 2, sr=sr, n_fft=N_FFT, hop_length=HOP_LENGTH)
+
+    return {
+        "tempo": float(np.atleast_1d(tempo)[0]),
+        "beat_frames": beat_frames,
+        "onset_frames": onset_frames,
+        "onset_envelope": onset_envelope,
+        "rms": rms,
+        "centroid": centroid,
+        "chroma": chroma,
+    }
+
+
+class StreamingFeatures:
+    """Running tempo, energy, brightness and onset statistics over audio blocks.
+
+    Blocks are consecutive audio_decode.stream_audio blocks (frame_length N_FFT, hop
+    HOP_LENGTH, so they overlap by N_FFT - HOP_LENGTH samples). The audio is
+    never kept: between blocks there are sums, a summed tempogram, the last
+    TEMPOGRAM_WINDOW onset-envelope frames, plus the per-frame
+    envelope/RMS/centroid and float16 chroma (36 bytes per 23ms frame) for the
+    feature arrays returned by result(), and the level 0 waveform peaks.
+    """
+
+    def __init__(self, sr: int):
+        import numpy as np
+
+        self.sr = sr
+        self.samples = 0  # Decoded so far
+        self.frames = 0
+        self.rms_sum = 0.0
+        self.centroid_sum = 0.0
+        self.tempogram_sum = np.zeros(TEMPOGRAM_WINDOW)
+        self.tempogram_columns = 0
+        self.onset_frames: List[int] = []
+        self.feature_blocks: List[Any] = []  # (envelope, rms, centroid, chroma) per block
+        self.onset_max = 0.0
+        self.last_onset = None
+        self.previous_mel = None  # Last mel frame, for the first difference of the next block
+        self.mel_db_max = -np.inf
+        self.envelope_tail = np.zeros(0)  # Last envelope frames (tempogram and peak-picking context)
+        self.envelope_start = 0  # Envelope frame index of envelope_tail[0]
+        self.picked_until = 0  # Envelope frames before this have been peak-picked
+        self.peaks = waveform.PeakAccumulator()
+
+        frames_per_second = sr / HOP_LENGTH
+        self.max_frames = int(ONSET_MAX_SECONDS * frames_per_second)
+        self.pre_frames = int(ONSET_AVG_SECONDS * frames_per_second)
+        self.post_frames = self.pre_frames + 1
+        self.wait_frames = int(ONSET_WAIT_SECONDS * frames_per_second)
+
+    def update(self, block, first: bool = False) -> None:
+        """Add one decoded block"""
+        import librosa
+        import numpy as np
+
+        self.samples += len(block) if first else max(0, len(block) - (N_FFT - HOP_LENGTH))
+        self.peaks.add(block if first else block[N_FFT - HOP_LENGTH:])  # New samples only
+        if len(block) < N_FFT:
+            return
+
+        S = np.abs(librosa.stft(block, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False))
+        self.frames += S.shape[1]
+        window = librosa.filters.get_window("hann", N_FFT, fftbins=True)
+        rms = librosa.feature.rms(S=S, frame_length=N_FFT, hop_length=HOP_LENGTH)[0] / np.sqrt(np.mean(window ** 2))
+        self.rms_sum += float(np.sum(rms))
+        centroid = librosa.feature.spectral_centroid(S=S, sr=self.sr, n_fft=N_FFT, hop_length=HOP_LENGTH)[0]
+        self.centroid_sum += float(np.sum(centroid))
+        chroma = librosa.feature.chroma_stft(S=S ** 2, sr=self.sr, n_fft=N_FFT, hop_length=HOP_LENGTH)
+
+        # Onset strength as in librosa.onset.onset_strength: mean positive
+        # first difference of the dB mel spectrogram, floored 80dB below the
+        # loudest value so far (power_to_db's top_db, against a running peak)
+        mel = librosa.power_to_db(librosa.feature.melspectrogram(S=S ** 2, sr=self.sr), top_db=None)
+        self.mel_db_max = max(self.mel_db_max, float(mel.max()))
+        mel = np.maximum(mel, self.mel_db_max - TOP_DB)
+        previous = mel[:, :1] if self.previous_mel is None else self.previous_mel
+        envelope = np.mean(np.maximum(0.0, np.diff(np.hstack([previous, mel]), axis=1)), axis=0)
+        self.previous_mel = mel[:, -1:]
+        self.feature_blocks.append(
+            (envelope.astype(np.float32), rms.astype(np.float32), centroid.astype(np.float32), chroma.astype(np.float16))
+        )
+
+        self.onset_max = max(self.onset_max, float(np.max(envelope, initial=0.0)))
+        self.envelope_tail = np.concatenate([self.envelope_tail, envelope])
+        self._update_tempogram(len(envelope))
+        self._pick_onsets(final=False)
+        self._trim_tail()
+
+    def _update_tempogram(self, new_frames: int) -> None:
+        """Sum the autocorrelation of every full window ending in the new frames"""
+        import librosa
+
+        tail = self.envelope_tail[-(TEMPOGRAM_WINDOW - 1 + new_frames):]
+        if len(tail) < TEMPOGRAM_WINDOW:
+            return
+        tempogram = librosa.feature.tempogram(
+            onset_envelope=tail, sr=self.sr, hop_length=HOP_LENGTH, win_length=TEMPOGRAM_WINDOW, center=False
+        )
+        self.tempogram_sum += tempogram.sum(axis=1)
+        self.tempogram_columns += tempogram.shape[1]
+
+    def _pick_onsets(self, final: bool) -> None:
+        """Peak-pick frames whose look-ahead is available (all of them at the end)"""
+        import librosa
+
+        if self.onset_max <= 0:
+            return
+        end = len(self.envelope_tail) if final else len(self.envelope_tail) - self.post_frames
+        peaks = librosa.util.peak_pick(
+            self.envelope_tail / self.onset_max,  # Normalised by the running maximum
+            pre_max=self.max_frames, post_max=1,
+            pre_avg=self.pre_frames, post_avg=self.post_frames,
+            delta=ONSET_DELTA, wait=self.wait_frames
+        )
+        for peak in peaks:
+            frame = self.envelope_start + int(peak)
+            if frame < self.picked_until or peak >= end:
+                continue
+            if self.last_onset is not None and frame - self.last_onset <= self.wait_frames:
+                continue
+            self.last_onset = frame
+            self.onset_frames.append(frame)
+        self.picked_until = max(self.picked_until, self.envelope_start + end)
+
+    def _trim_tail(self) -> None:
+        keep = max(TEMPOGRAM_WINDOW - 1, self.pre_frames + self.post_frames)
+        if len(self.envelope_tail) > keep:
+            self.envelope_start += len(self.envelope_tail) - keep
+            self.envelope_tail = self.envelope_tail[-keep:]
+
+    def result(self) -> Dict[str, Any]:
+        """Aggregate features of everything added so far (per-frame arrays under "features",
+        waveform peak pyramid under "waveform")"""
+        import librosa
+        import numpy as np
+
+        self._pick_onsets(final=True)
+        if self.tempogram_columns:
+            tempogram = (self.tempogram_sum / self.tempogram_columns)[:, None]
+            tempo = librosa.feature.tempo(tg=tempogram, sr=self.sr, hop_length=HOP_LENGTH, aggregate=None)
+        else:  # Shorter than one tempogram window
+            tempo = librosa.feature.tempo(onset_envelope=self.envelope_tail, sr=self.sr, hop_length=HOP_LENGTH)
+        duration = self.samples / self.sr
+
+        if self.feature_blocks:
+            envelope, rms, centroid, chroma = (np.concatenate(arrays, axis=-1) for arrays in zip(*self.feature_blocks))
+        else:
+            envelope = rms = centroid = np.zeros(0, dtype=np.float32)
+            chroma = np.zeros((12, 0), dtype=np.float16)
+        frame_offset = N_FFT / 2 / self.sr  # Frames are not centred (center=False)
+        beat_frames = np.zeros(0, dtype=int)
+        if len(envelope):
+            _, beat_frames = librosa.beat.beat_track(
+                onset_envelope=envelope, sr=self.sr, hop_length=HOP_LENGTH, bpm=float(tempo[0])
+            )
+        return {
+            "sr": self.sr,
+            "samples": self.samples,
+            "duration": duration,
+            "tempo": float(tempo[0]),
+            "energy_level": self.rms_sum / max(1, self.frames),
+            "brightness": self.centroid_sum / max(1, self.frames),
+            "onset_count": len(self.onset_frames),
+            "onset_rate": len(self.onset_frames) / duration if duration else 0.0,
+            "features": feature_arrays(
+                self.sr, frame_offset, envelope, rms, centroid, chroma,
+                np.asarray(beat_frames) * HOP_LENGTH / self.sr + frame_offset,
+                np.asarray(self.onset_frames, dtype=int) * HOP_LENGTH / self.sr + frame_offset
+            ),
+            "waveform": waveform.peak_pyramid(self.peaks.peaks()),
+        }
+
+
+def stream_audio_features(
+    file_path: str,
+    offset: float = 0.0,
+    duration: Optional[float] = None
+) -> Dict[str, Any]:
+    """StreamingFeatures over a file (or an excerpt), decoded block by block"""
+    features = StreamingFeatures(ANALYSIS_SAMPLE_RATE)
+    blocks = stream_audio(
+        file_path, STREAM_BLOCK_FRAMES, N_FFT, HOP_LENGTH, ANALYSIS_SAMPLE_RATE, offset, duration
+    )
+    for i, block in enumerate(blocks):
+        features.update(block, first=i == 0)
+    return features.result()
+
+
+def feature_arrays(sr: int, frame_offset: float, envelope, rms, centroid, chroma, beat_times, onset_times) -> Dict[str, Any]:
+    """Feature arrays as cached (features.npz): per-frame curves and event times in seconds.
+
+    Frame i of the curves (and column i of the 12 x frames chroma) is at
+    i / frame_rate + frame_offset seconds.
+    """
+    import numpy as np
+
+    return {
+        "frame_rate": np.float64(sr / HOP_LENGTH),
+        "frame_offset": np.float64(frame_offset),
+        "onset_envelope": np.asarray(envelope, dtype=np.float32),
+        "rms": np.asarray(rms, dtype=np.float32),
+        "centroid": np.asarray(centroid, dtype=np.float32),
+        "chroma": np.asarray(chroma, dtype=np.float16),
+        "beat_times": np.asarray(beat_times, dtype=np.float32),
+        "onset_times": np.asarray(onset_times, dtype=np.float32),
+    }
+
+
+def music_analysis_fields(
+    features: Dict[str, Any],
+    arrays: Dict[str, Any],
+    duration: float,
+    analyzed_seconds: float
+) -> Dict[str, Any]:
+    """MusicAnalysis fields from extracted features and their feature_arrays.
+
+    key_moments are the scene starts of a structural segmentation of the
+    whole track (segmentation.boundaries).
+    """
+    tempo = features["tempo"]
+    labels = describe_music(tempo, features["energy_level"])
+    return {
+        "duration": float(duration),
+        "tempo": tempo,
+        "mood": labels["mood"],
+        "energy": labels["energy"],
+        "genre": labels["genre"],
+        "key_moments": segmentation.boundaries(arrays, duration, segmentation.segment_count(duration)),
+        "description": f"A {labels['mood']} {labels['genre']} track with {labels['energy']} at {int(tempo)} BPM",
+        "brightness": features["brightness"],
+        "analyzed_seconds": round(float(analyzed_seconds), 3),
+    }
+
+
+def analyze_audio_file(file_path: str, full_track: bool = True) -> Dict[str, Any]:
+    """Analyze an audio file.
+
+    Returns {"analysis": MusicAnalysis fields, "features": feature_arrays(...),
+    "waveform": peak pyramid levels of the decoded audio,
+    "decoded_duration": seconds of audio actually decoded}.
+    full_track streams the whole file through StreamingFeatures; otherwise
+    the first ANALYSIS_SECONDS are decoded and analyzed in one go.
+    Raises ImportError when librosa is not installed.
+    """
+    import librosa
+    import numpy as np
+
+    if full_track:
+        features = stream_audio_features(file_path)
+        return {
+            "analysis": music_analysis_fields(
+                features, features["features"], features["duration"], features["duration"]
+            ),
+            "features": features["features"],
+            "waveform": features["waveform"],
+            "decoded_duration": features["duration"],
+        }
+
+    sr = ANALYSIS_SAMPLE_RATE
+    y = decode_audio(file_path, sr, duration=ANALYSIS_SECONDS)
+    duration_full = probe_duration(file_path) or len(y) / sr
+
+    features = extract_features(y, sr)
+    onset_times = librosa.frames_to_time(features["onset_frames"], sr=sr, hop_length=HOP_LENGTH)
+    beat_times = librosa.frames_to_time(features["beat_frames"], sr=sr, hop_length=HOP_LENGTH)
+    arrays = feature_arrays(
+        sr, 0.0, features["onset_envelope"], features["rms"], features["centroid"], features["chroma"],
+        beat_times, onset_times
+    )
+    summary = {
+        "tempo": features["tempo"],
+        "energy_level": float(np.mean(features["rms"])),
+        "brightness": float(np.mean(features["centroid"])),  # Spectral features for mood
+    }
+    return {
+        "analysis": music_analysis_fields(summary, arrays, duration_full, len(y) / sr),
+        "features": arrays,
+        "waveform": waveform.peak_pyramid(waveform.block_peaks(y)),
+        "decoded_duration": len(y) / sr,
+    }
@@ -0,0 +1,100 @@
+"""Audio decoding through an FFmpeg pipe.
+
+FFmpeg decodes any upload format, downmixes to mono and resamples to the
+analysis rate in one process, writing raw float32 PCM to stdout, which is
+read straight into NumPy. This replaces librosa.load's soundfile/audioread
+backends and its (slow, high-quality) resampler. decode_audio returns a
+whole excerpt; stream_audio yields overlapping fixed-size blocks like
+librosa.stream, for analysis in constant memory.
+"""
+import re
+import subprocess
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+ANALYSIS_SAMPLE_RATE = 22050  # librosa's default rate
+BYTES_PER_SAMPLE = 4  # f32le
+
+
+def decode_command(
+    file_path: str,
+    sr: int = ANALYSIS_SAMPLE_RATE,
+    offset: float = 0.0,
+    duration: Optional[float] = None
+) -> List[str]:
+    """FFmpeg command writing mono float32 PCM at sr to stdout"""
+    cmd = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error"]
+    if offset:
+        cmd += ["-ss", f"{offset:.3f}"]  # Input seek: decoding starts near the offset
+    if duration is not None:
+        cmd += ["-t", f"{duration:.3f}"]
+    return cmd + ["-i", file_path, "-vn", "-f", "f32le", "-ac", "1", "-ar", str(sr), "-"]
+
+
+def decode_audio(
+    file_path: str,
+    sr: int = ANALYSIS_SAMPLE_RATE,
+    offset: float = 0.0,
+    duration: Optional[float] = None
+) -> np.ndarray:
+    """Decode (an excerpt of) an audio file to a mono float32 array at sr"""
+    result = subprocess.run(decode_command(file_path, sr, offset, duration), capture_output=True)
+    if result.returncode != 0:
+        raise Exception(f"FFmpeg failed to decode audio: {result.stderr.decode(errors='replace')[-2000:]}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def stream_audio(
+    file_path: str,
+    block_length: int,
+    frame_length: int,
+    hop_length: int,
+    sr: int = ANALYSIS_SAMPLE_RATE,
+    offset: float = 0.0,
+    duration: Optional[float] = None
+) -> Iterator[np.ndarray]:
+    """Yield blocks of block_length frames, like librosa.stream.
+
+    Each block holds frame_length + (block_length - 1) * hop_length samples and
+    overlaps the previous one by frame_length - hop_length, so STFTs of the
+    blocks with center=False tile the signal. The last block may be shorter.
+    FFmpeg is stopped if the consumer stops early.
+    """
+    block_samples = frame_length + (block_length - 1) * hop_length
+    overlap = frame_length - hop_length
+    process = subprocess.Popen(
+        decode_command(file_path, sr, offset, duration),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL
+    )
+    try:
+        carry = np.zeros(0, dtype=np.float32)
+        while True:
+            data = process.stdout.read((block_samples - len(carry)) * BYTES_PER_SAMPLE)
+            if not data:
+                break
+            samples = np.frombuffer(data[:len(data) - len(data) % BYTES_PER_SAMPLE], dtype=np.float32)
+            block = np.concatenate([carry, samples])
+            if len(block) < block_samples:
+                yield block  # End of stream
+                break
+            yield block
+            carry = block[-overlap:] if overlap else np.zeros(0, dtype=np.float32)
+        process.stdout.close()
+        stderr = process.stderr.read().decode(errors="replace")
+        if process.wait() != 0:
+            raise Exception(f"FFmpeg failed to decode audio: {stderr[-2000:]}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def probe_duration(file_path: str) -> Optional[float]:
+    """Duration from the container header (FFmpeg's input summary), without decoding"""
+    result = subprocess.run(["ffmpeg", "-nostdin", "-hide_banner", "-i", file_path], capture_output=True)
+    match = re.search(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
@@ -0,0 +1,189 @@
+"""Render and analysis benchmarks for the FIBO backend.
+
+Usage:
+    python benchmarks.py render --scenes 24 --duration 180 --profile standard
+    python benchmarks.py transitions --scenes 24 --duration 180 --profile standard
+    python benchmarks.py music-features --duration 60 --runs 5
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+import audio_analysis
+import audio_decode
+import main
+
+
+def make_stills(directory: str, count: int, size=(1792, 1024)) -> list:
+    """Smooth synthetic stills that compress like generated images (not like noise)"""
+    rng = np.random.default_rng(5555)
+    paths = []
+    for i in range(count):
+        small = (rng.random((size[1] // 16, size[0] // 16, 3)) * 255).astype("uint8")
+        image = Image.fromarray(small).resize(size, Image.BICUBIC).filter(ImageFilter.GaussianBlur(3))
+        path = os.path.join(directory, f"scene_{i:04d}.png")
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def make_tone(path: str, duration: float) -> str:
+    """Sine tone used as the soundtrack"""
+    main.subprocess.run(
+        ["ffmpeg", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}", path],
+        capture_output=True, check=True
+    )
+    return path
+
+
+def use_fresh_render_cache(directory: str) -> None:
+    """Point the render caches at an empty directory so nothing is a cache hit"""
+    main.RENDER_CACHE_DIR = os.path.join(directory, "render_cache")
+    main.SEGMENT_CACHE_DIR = os.path.join(main.RENDER_CACHE_DIR, "segments")
+    shutil.rmtree(main.RENDER_CACHE_DIR, ignore_errors=True)
+
+
+async def encode_single_process(image_files, durations, output_path, profile, audio_path) -> None:
+    """Reference path: the whole timeline through one FFmpeg process"""
+    work_dir = os.path.dirname(output_path)
+    concat_file = os.path.join(work_dir, "single.txt")
+    with open(concat_file, "w") as f:
+        for image_file, duration in zip(image_files, durations):
+            f.write(f"file '{os.path.basename(image_file)}'\nduration {duration}\n")
+        f.write(f"file '{os.path.basename(image_files[-1])}'\n")
+
+    video_filter = main.still_scale_filter(profile)
+    if not profile["vfr"]:
+        video_filter += f",fps={profile['fps']}"
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_file, "-i", audio_path, "-vf", video_filter]
+    if profile["vfr"]:
+        cmd += ["-fps_mode", "vfr"]
+    cmd += main.build_video_encode_args(profile)
+    cmd += ["-c:a", "aac", "-b:a", profile["audio_bitrate"], "-shortest", output_path]
+    await main.run_ffmpeg(cmd, cwd=work_dir)
+
+
+async def bench_render(args) -> None:
+    profile = main.get_render_profile(args.profile)
+    with tempfile.TemporaryDirectory() as work_dir:
+        image_files = make_stills(work_dir, args.scenes)
+        durations = [args.duration / args.scenes] * args.scenes
+        audio_path = make_tone(os.path.join(work_dir, "tone.mp3"), args.duration)
+
+        start = time.perf_counter()
+        await encode_single_process(image_files, durations, os.path.join(work_dir, "single.mp4"), profile, audio_path)
+        single = time.perf_counter() - start
+
+        use_fresh_render_cache(work_dir)
+        start = time.perf_counter()
+        await main.encode_slideshow(image_files, durations, os.path.join(work_dir, "parallel.mp4"), profile, audio_path)
+        parallel = time.perf_counter() - start
+
+    print()
+    print(f"{args.scenes} scenes, {args.duration:.0f}s, '{profile['name']}' profile, "
+          f"{os.cpu_count()} cores, {main.RENDER_MAX_PARALLEL} parallel encoders")
+    print(f"  single process    : {single:7.2f}s")
+    print(f"  segment-parallel  : {parallel:7.2f}s  ({single / parallel:.2f}x)")
+
+
+async def bench_transitions(args) -> None:
+    profile = main.get_render_profile(args.profile)
+    timings = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        image_files = make_stills(work_dir, args.scenes)
+        durations = [args.duration / args.scenes] * args.scenes
+        audio_path = make_tone(os.path.join(work_dir, "tone.mp3"), args.duration)
+
+        for transition in ("cut", "smooth", "fade"):
+            use_fresh_render_cache(work_dir)
+            start = time.perf_counter()
+            await main.encode_slideshow(
+                image_files, durations, os.path.join(work_dir, f"{transition}.mp4"), profile, audio_path,
+                transition=transition
+            )
+            timings[transition] = time.perf_counter() - start
+
+    cut = timings["cut"]
+    print()
+    print(f"{args.scenes} scenes, {args.duration:.0f}s, '{profile['name']}' profile, "
+          f"{main.TRANSITION_SECONDS}s transitions, {os.cpu_count()} cores")
+    print(f"  cut (segments)    : {cut:7.2f}s")
+    for transition in ("smooth", "fade"):
+        overhead = timings[transition] - cut
+        print(f"  {transition:<6} (windowed): {timings[transition]:7.2f}s  "
+              f"(+{overhead:.2f}s, {overhead / (args.scenes - 1):+.3f}s per transition)")
+
+
+def make_track(path: str, duration: float) -> str:
+    """Tone with a noise burst on every beat (120 BPM), so there is something to track"""
+    main.subprocess.run(
+        ["ffmpeg", "-y", "-f", "lavfi", "-i", f"sine=frequency=220:duration={duration}",
+         "-f", "lavfi", "-i", f"anoisesrc=d={duration}:a=0.3",
+         "-filter_complex", "[1]volume='if(lt(mod(t,0.5),0.05),1,0)':eval=frame[beats];[0][beats]amix", path],
+        capture_output=True, check=True
+    )
+    return path
+
+
+def separate_features(y, sr) -> None:
+    """Reference path: every feature computed from the signal on its own"""
+    import librosa
+    librosa.beat.beat_track(y=y, sr=sr)
+    librosa.feature.rms(y=y)
+    librosa.feature.spectral_centroid(y=y, sr=sr)
+    librosa.onset.onset_detect(y=y, sr=sr)
+    librosa.feature.chroma_stft(y=y, sr=sr)
+
+
+async def bench_music_features(args) -> None:
+    with tempfile.TemporaryDirectory() as work_dir:
+        y = audio_decode.decode_audio(make_track(os.path.join(work_dir, "track.wav"), args.duration))
+    sr = audio_decode.ANALYSIS_SAMPLE_RATE
+
+    audio_analysis.warm_up()  # Keep numba's JIT out of the timings
+    timings = {}
+    for name, extract in (("separate", separate_features), ("shared", audio_analysis.extract_features)):
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            extract(y, sr)
+        timings[name] = (time.perf_counter() - start) / args.runs
+
+    print()
+    print(f"{args.duration:.0f}s track at {sr} Hz, mean of {args.runs} runs")
+    print(f"  separate features : {timings['separate'] * 1000:8.1f}ms")
+    print(f"  shared STFT       : {timings['shared'] * 1000:8.1f}ms  ({timings['separate'] / timings['shared']:.2f}x)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    render = subparsers.add_parser("render", help="Single-process vs segment-parallel video encode")
+    render.add_argument("--scenes", type=int, default=24)
+    render.add_argument("--duration", type=float, default=180.0)
+    render.add_argument("--profile", default="standard")
+    render.set_defaults(run=bench_render)
+
+    transitions = subparsers.add_parser("transitions", help="Single-filtergraph transitions vs the cut-only encode")
+    transitions.add_argument("--scenes", type=int, default=24)
+    transitions.add_argument("--duration", type=float, default=180.0)
+    transitions.add_argument("--profile", default="standard")
+    transitions.set_defaults(run=bench_transitions)
+
+    music_features = subparsers.add_parser("music-features", help="Per-feature librosa calls vs the shared STFT pipeline")
+    music_features.add_argument("--duration", type=float, default=60.0)
+    music_features.add_argument("--runs", type=int, default=5)
+    music_features.set_defaults(run=bench_music_features)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(args.run(args))
@@ -1,6 +1,8 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 from typing import Optional, Dict, Any, List
 import os
 from dotenv import load_dotenv
@@ -8,18 +10,43 @@ import google.generativeai as genai
 import httpx
 import json
 import asyncio
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageOps, UnidentifiedImageError
+import numpy as np
+import bisect
 import io
 import base64
 import tempfile
 import subprocess
 import shutil
+import hashlib
+import math
+import mimetypes
+import multiprocessing
+import re
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
 from datetime import datetime
+from urllib.parse import quote
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import audio_analysis
+import motion
+import segmentation
+import waveform
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="BRIA FIBO API with Gemini Routing")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the worker pools with the server and stop them with it"""
+    await warm_analysis_pool()
+    yield
+    shutdown_worker_pools()
+
+app = FastAPI(title="BRIA FIBO API with Gemini Routing", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -28,6 +55,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Waveform-Level", "X-Waveform-Levels", "X-Waveform-Peaks", "X-Waveform-Samples-Per-Peak",
+        "X-Waveform-Sample-Rate", "X-Waveform-Format", "X-Waveform-Mode",
+    ],
 )
 
 # Configure Gemini
@@ -89,8 +120,17 @@ class GenerateRequest(BaseModel):
     guidance_scale: Optional[float] = 7.5
     negative_prompt: Optional[str] = None
     force_category: Optional[str] = None  # Manual category override
+    speculative_policy: Optional[str] = None  # off | image (see SPECULATIVE_GENERATION)
+    plan_token: Optional[str] = None  # From /api/preview-video-prompts: skip the Gemini planning
+    dedupe_threshold: Optional[float] = None  # Prompt similarity above which frames are derived, not generated
+    latency_budget_seconds: Optional[float] = None  # Video: target time, picks keyframes/profile/concurrency
     tailored_model_id: Optional[str] = None  # For tailored models
     image_url: Optional[str] = None  # For image-to-video
+    render_profile: Optional[str] = None  # preview | standard | archival (video only)
+    two_phase: Optional[bool] = None  # Return a low-res proxy first, final render in background
+    hls: Optional[bool] = None  # Also write an HLS rendition (fMP4 segments + playlist)
+    motion: Optional[bool] = None  # Video: pan/zoom each keyframe per its camera_movement (see MOTION_RENDER)
+    transitions: Optional[bool] = None  # Video: apply the timeline's transition_type (see TRANSITIONS)
 
 class StructuredPromptRequest(BaseModel):
     prompt: str
@@ -434,25 +474,1125 @@ Respond ONLY with valid JSON (no markdown):
             transition_type="smooth"
         )
 
-async def assemble_video_from_frames(frame_images: List[Dict[str, Any]], timeline: VideoTimeline, prompt: str = "") -> str:
-    """Download frame images and assemble into video using FFmpeg"""
-    import shutil
-    from datetime import datetime
-    
+# ============================================================================
+# METRICS
+# ============================================================================
+
+# In-process counters, gauges and moving averages, exposed at /api/metrics.
+# EWMA values smooth latencies so recent behaviour dominates.
+METRICS_EWMA_ALPHA = 0.2
+
+metrics: Dict[str, float] = {}
+
+def metric_inc(name: str, value: float = 1.0) -> None:
+    """Add to a counter (or move a gauge up/down with a negative value)"""
+    metrics[name] = metrics.get(name, 0.0) + value
+
+def metric_observe(name: str, value: float) -> None:
+    """Record a sample: keeps a count, a total and an exponentially weighted average"""
+    metric_inc(f"{name}_count")
+    metric_inc(f"{name}_total", value)
+    previous = metrics.get(f"{name}_ewma")
+    metrics[f"{name}_ewma"] = value if previous is None else previous + METRICS_EWMA_ALPHA * (value - previous)
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Current values of all in-process metrics"""
+    return {name: round(value, 4) for name, value in sorted(metrics.items())}
+
+# ============================================================================
+# VIDEO ARTIFACTS
+# ============================================================================
+
+# Rendered videos are served from disk instead of being inlined as base64
+GENERATED_VIDEOS_DIR = os.path.join(os.getcwd(), "generated_videos")
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")  # Empty = relative URLs
+ARTIFACT_CACHE_CONTROL = "public, max-age=86400"
+
+def artifact_id_for(path: str) -> str:
+    """Get the artifact id (path relative to generated_videos) for a file"""
+    relative = os.path.relpath(os.path.abspath(path), GENERATED_VIDEOS_DIR)
+    if relative.startswith(".."):
+        raise ValueError(f"{path} is not inside {GENERATED_VIDEOS_DIR}")
+    return relative.replace(os.sep, "/")
+
+def artifact_url(path: str) -> str:
+    """Build the short URL that serves a file from generated_videos"""
+    return f"{PUBLIC_BASE_URL}/api/artifacts/{quote(artifact_id_for(path))}"
+
+def resolve_artifact_path(artifact_id: str) -> str:
+    """Map an artifact id back to a file, refusing anything outside generated_videos"""
+    base = os.path.abspath(GENERATED_VIDEOS_DIR)
+    path = os.path.abspath(os.path.join(base, artifact_id))
+    if os.path.commonpath([base, path]) != base or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return path
+
+class ArtifactResponse(FileResponse):
+    """FileResponse that uses the ASGI zero-copy send extension when the server offers it"""
+    chunk_size = 1024 * 1024
+
+    async def __call__(self, scope, receive, send):
+        self.zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def _send_file(self, send, start: int, count: int) -> None:
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": fd,
+                "offset": start,
+                "count": count,
+                "more_body": False,
+            })
+        finally:
+            os.close(fd)
+
+    async def _handle_simple(self, send, send_header_only: bool) -> None:
+        if not self.zerocopy or send_header_only:
+            return await super()._handle_simple(send, send_header_only)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await self._send_file(send, 0, int(self.headers["content-length"]))
+
+    async def _handle_single_range(self, send, start: int, end: int, file_size: int, send_header_only: bool) -> None:
+        if not self.zerocopy or send_header_only:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        await self._send_file(send, start, end - start)
+
+@app.api_route("/api/artifacts/{artifact_id:path}", methods=["GET", "HEAD"])
+async def get_artifact(artifact_id: str, request: Request):
+    """Serve a rendered file with HTTP Range and ETag support"""
+    path = resolve_artifact_path(artifact_id)
+    touch_workspace(artifact_id)
+    response = ArtifactResponse(path, headers={"Cache-Control": ARTIFACT_CACHE_CONTROL}, stat_result=os.stat(path))
+
+    # Conditional request: the client already has this exact file
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and response.headers["etag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={
+            "ETag": response.headers["etag"],
+            "Cache-Control": ARTIFACT_CACHE_CONTROL,
+        })
+
+    return response
+
+# ============================================================================
+# RENDER CACHE
+# ============================================================================
+
+# Finished renders are kept by a key over the input content (frame hashes,
+# durations, audio hash, encoder settings), so re-assembling the same frames
+# is a hardlink instead of an encode. Per-image segments are cached the same
+# way. Least recently used entries are evicted once the cache exceeds its
+# disk budget.
+RENDER_CACHE_DIR = os.path.join(GENERATED_VIDEOS_DIR, "render_cache")
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_MB", "2048")) * 1024 * 1024
+SEGMENT_CACHE_DIR = os.path.join(RENDER_CACHE_DIR, "segments")
+RENDER_CACHE_VERSION = 2  # Bump when encode commands change in ways profiles don't capture
+
+_file_hash_memo: Dict[tuple, str] = {}
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file's content, memoized on (path, size, mtime)"""
+    stat_result = os.stat(path)
+    memo_key = (os.path.abspath(path), stat_result.st_size, stat_result.st_mtime_ns)
+    if memo_key in _file_hash_memo:
+        return _file_hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    if len(_file_hash_memo) > 4096:
+        _file_hash_memo.clear()
+    _file_hash_memo[memo_key] = digest.hexdigest()
+    return _file_hash_memo[memo_key]
+
+def render_cache_key(
+    image_files: List[str],
+    durations: List[float],
+    profile: Dict[str, Any],
+    audio_path: Optional[str] = None,
+    extra: Optional[Dict[str, Any]] = None
+) -> str:
+    """Cache key over everything that determines the rendered bytes"""
+    key_data = {
+        "version": RENDER_CACHE_VERSION,
+        "frames": [file_sha256(path) for path in image_files],
+        "durations": [round(d, 3) for d in durations],
+        "audio": file_sha256(audio_path) if audio_path else None,
+        "profile": profile,
+        "extra": extra or {},
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+def link_or_copy(source: str, destination: str) -> None:
+    """Hardlink source to destination (atomically replacing it), copying across filesystems"""
+    temp_path = f"{destination}.{uuid.uuid4().hex}.tmp"
     try:
-        # Create organized output directory
-        output_base = os.path.join(os.getcwd(), "generated_videos")
-        os.makedirs(output_base, exist_ok=True)
-        
-        # Create timestamped folder for this video
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        video_dir = os.path.join(output_base, f"video_{timestamp}")
-        os.makedirs(video_dir, exist_ok=True)
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copy2(source, temp_path)
+    os.replace(temp_path, destination)
+
+def render_cache_lookup(key: str, output_path: str) -> bool:
+    """On a cache hit, place the cached render at output_path and mark it recently used"""
+    cached_path = os.path.join(RENDER_CACHE_DIR, f"{key}.mp4")
+    if not os.path.isfile(cached_path):
+        return False
+    os.utime(cached_path)  # mtime doubles as the LRU timestamp
+    if os.path.abspath(cached_path) != os.path.abspath(output_path):
+        link_or_copy(cached_path, output_path)
+    return True
+
+def render_cache_store(key: str, output_path: str) -> None:
+    """Add a finished render to the cache and enforce the disk budget"""
+    try:
+        os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        link_or_copy(output_path, os.path.join(RENDER_CACHE_DIR, f"{key}.mp4"))
+        evict_render_cache()
+    except OSError as e:
+        print(f"      ⚠️  Could not cache render: {str(e)}")
+
+def evict_render_cache() -> None:
+    """Delete least recently used renders and segments until the cache fits its budget"""
+    entries = []
+    for root, _, names in os.walk(RENDER_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            if name.endswith(".mp4"):
+                stat_result = os.stat(path)
+                entries.append((stat_result.st_mtime, stat_result.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= RENDER_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+        print(f"      🧹 Evicted cached render {os.path.basename(path)}")
+
+# ============================================================================
+# JOB WORKSPACES
+# ============================================================================
+
+# Every render job gets its own directory under generated_videos. Final
+# outputs and the small text files stay there; downloaded images, audio,
+# segments and concat lists go to a scratch directory that is deleted when
+# the job finishes (optionally on tmpfs, e.g. RENDER_SCRATCH_DIR=/dev/shm/fibo).
+# Job directories expire after a TTL and, over the quota, the least recently
+# used ones are evicted first. Serving an artifact counts as a use.
+WORKSPACE_MAX_BYTES = int(os.getenv("GENERATED_VIDEOS_MAX_MB", "4096")) * 1024 * 1024
+WORKSPACE_TTL_SECONDS = float(os.getenv("GENERATED_VIDEOS_TTL_HOURS", "72")) * 3600
+RENDER_SCRATCH_DIR = os.getenv("RENDER_SCRATCH_DIR", "")
+WORKSPACE_RESERVED_DIRS = {"render_cache", "analysis_cache", "youtube_cache"}  # Managed by their own budgets
+
+active_workspaces = set()  # Job ids that are still rendering (never evicted)
+
+def directory_size(path: str) -> int:
+    """Total size of the files under a directory"""
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def evict_workspaces() -> None:
+    """Delete expired job directories, then least recently used ones until under the quota"""
+    now = time.time()
+    entries = []
+    for entry in os.scandir(GENERATED_VIDEOS_DIR):
+        if not entry.is_dir() or entry.name in WORKSPACE_RESERVED_DIRS or entry.name in active_workspaces:
+            continue
+        last_used = entry.stat().st_mtime
+        if now - last_used > WORKSPACE_TTL_SECONDS:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            print(f"      🧹 Removed expired workspace {entry.name}")
+            continue
+        entries.append((last_used, directory_size(entry.path), entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= WORKSPACE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        print(f"      🧹 Evicted workspace {os.path.basename(path)} ({size / 1e6:.1f} MB)")
+
+    # Scratch left behind by a crashed process
+    if RENDER_SCRATCH_DIR and os.path.isdir(RENDER_SCRATCH_DIR):
+        for entry in os.scandir(RENDER_SCRATCH_DIR):
+            if entry.name not in active_workspaces and now - entry.stat().st_mtime > RENDER_JOB_TTL_SECONDS:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+def touch_workspace(artifact_id: str) -> None:
+    """Mark the job directory an artifact belongs to as recently used"""
+    job_dir = os.path.join(GENERATED_VIDEOS_DIR, artifact_id.split("/", 1)[0])
+    if os.path.isdir(job_dir) and os.path.basename(job_dir) not in WORKSPACE_RESERVED_DIRS:
+        os.utime(job_dir)
+
+class JobWorkspace:
+    """Collision-free output directory for one render job, plus its scratch directory"""
+
+    def __init__(self, kind: str):
+        os.makedirs(GENERATED_VIDEOS_DIR, exist_ok=True)
+        self.job_id = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.dir = os.path.join(GENERATED_VIDEOS_DIR, self.job_id)
+        if RENDER_SCRATCH_DIR:
+            self.scratch_dir = os.path.join(RENDER_SCRATCH_DIR, self.job_id)
+        else:
+            self.scratch_dir = os.path.join(self.dir, "scratch")
+        os.makedirs(self.dir)
+        os.makedirs(self.scratch_dir)
+        active_workspaces.add(self.job_id)
+
+    @classmethod
+    async def create(cls, kind: str) -> "JobWorkspace":
+        """New workspace, after evicting old ones in a worker thread (it walks the whole tree)"""
+        try:
+            await asyncio.to_thread(evict_workspaces)
+        except OSError as e:
+            print(f"      ⚠️  Workspace eviction failed: {str(e)}")
+        return cls(kind)
+
+    def path(self, name: str) -> str:
+        """Path of a file that is kept with the job"""
+        return os.path.join(self.dir, name)
+
+    def scratch(self, name: str) -> str:
+        """Path of an intermediate file that is deleted when the job finishes"""
+        return os.path.join(self.scratch_dir, name)
+
+    def finish(self) -> None:
+        """Delete intermediates and let the workspace be evicted (safe to call twice)"""
+        if self.job_id not in active_workspaces:
+            return
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        active_workspaces.discard(self.job_id)
+        print(f"      🧹 Cleaned up intermediates, {self.job_id} keeps {directory_size(self.dir) / 1e6:.1f} MB")
+
+# ============================================================================
+# RENDER PROFILES
+# ============================================================================
+
+# Our videos are slideshows of still images. Variable frame rate encodes each
+# still once (instead of duplicating it 30x a second), -tune stillimage suits
+# the content and keyframes land on scene boundaries. "fps" is the constant
+# rate used when a profile is not VFR, "motion_fps" the rate of camera-motion
+# renders (which need real frames, so are never VFR).
+RENDER_PROFILES = {
+    "preview": {
+        "width": 854, "height": 480, "fps": 5, "vfr": True, "motion_fps": 15,
+        "preset": "veryfast", "crf": 30, "keyint_seconds": 10, "audio_bitrate": "96k",
+    },
+    "standard": {
+        "width": 1920, "height": 1080, "fps": 10, "vfr": True, "motion_fps": 25,
+        "preset": "fast", "crf": 23, "keyint_seconds": 4, "audio_bitrate": "160k",
+    },
+    "archival": {
+        "width": 1920, "height": 1080, "fps": 24, "vfr": False, "motion_fps": 30,
+        "preset": "slow", "crf": 18, "keyint_seconds": 2, "audio_bitrate": "256k",
+    },
+}
+# First phase of a two-phase render: playable as soon as possible (internal, not client-selectable)
+PROXY_RENDER_PROFILE = {
+    "name": "proxy", "width": 640, "height": 360, "fps": 5, "vfr": True, "motion_fps": 12,
+    "preset": "ultrafast", "crf": 32, "keyint_seconds": 10, "audio_bitrate": "64k",
+}
+DEFAULT_RENDER_PROFILE = os.getenv("DEFAULT_RENDER_PROFILE", "standard")
+
+# Segments are encoded in parallel, one FFmpeg per core (shared by all requests)
+RENDER_MAX_PARALLEL = max(1, int(os.getenv("RENDER_MAX_PARALLEL", "0")) or min(os.cpu_count() or 1, 8))
+render_slots = asyncio.Semaphore(RENDER_MAX_PARALLEL)
+
+# Camera motion (see motion.py) is rendered in a thread for short timelines
+# and spread over a process pool for long ones. Opt-in: it renders every frame
+MOTION_RENDER_DEFAULT = os.getenv("MOTION_RENDER", "false").lower() == "true"
+MOTION_POOL_MIN_SEGMENTS = int(os.getenv("MOTION_POOL_MIN_SEGMENTS", "6"))
+motion_pool = None
+
+def get_motion_pool() -> ProcessPoolExecutor:
+    """Process pool for motion rendering, started on first use"""
+    global motion_pool
+    if motion_pool is None:
+        # spawn: forking a process that runs threads and an event loop is unsafe
+        motion_pool = ProcessPoolExecutor(max_workers=RENDER_MAX_PARALLEL, mp_context=multiprocessing.get_context("spawn"))
+    return motion_pool
+
+# Optional HLS rendition (fMP4 segments + VOD playlist) next to the MP4, so
+# players can start after the first segment and only fetch what they play
+HLS_OUTPUT_DEFAULT = os.getenv("HLS_OUTPUT", "false").lower() == "true"
+HLS_SEGMENT_SECONDS = 4
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/iso.segment", ".m4s")
+
+def get_render_profile(name: Optional[str]) -> Dict[str, Any]:
+    """Look up a render profile by name (None = default profile)"""
+    name = name or DEFAULT_RENDER_PROFILE
+    if name not in RENDER_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown render profile '{name}'. Choose one of: {', '.join(RENDER_PROFILES)}"
+        )
+    return {"name": name, **RENDER_PROFILES[name]}
+
+def motion_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Variant of a render profile for Ken Burns camera motion (constant frame rate)"""
+    return {**profile, "vfr": False, "fps": profile["motion_fps"], "motion": True}
+
+def render_metric_name(profile: Dict[str, Any], transition: str = "cut") -> str:
+    """Name render timings are recorded under; motion and transitions cost more per frame"""
+    name = f"{profile['name']}_motion" if profile.get("motion") else profile["name"]
+    return name if transition == "cut" else f"{name}_transitions"
+
+async def run_ffmpeg(cmd: List[str], cwd: Optional[str] = None) -> None:
+    """Run an FFmpeg command in a worker thread so the event loop stays free"""
+    result = await asyncio.to_thread(subprocess.run, cmd, capture_output=True, text=True, cwd=cwd)
+    if result.returncode != 0:
+        print(f"      ❌ FFmpeg error: {result.stderr[-2000:]}")
+        raise Exception(f"FFmpeg failed: {result.stderr[-2000:]}")
+
+def build_video_encode_args(profile: Dict[str, Any], keyframe_times: Optional[List[float]] = None) -> List[str]:
+    """libx264 output arguments for a render profile"""
+    args = [
+        "-c:v", "libx264",
+        "-preset", profile["preset"],
+        "-tune", "film" if profile.get("motion") else "stillimage",
+        "-crf", str(profile["crf"]),
+        "-g", str(profile["fps"] * profile["keyint_seconds"]),
+        "-pix_fmt", "yuv420p",
+    ]
+    if keyframe_times:
+        # Put a keyframe on every scene change so seeking to a scene is instant
+        args += ["-force_key_frames", ",".join(f"{t:.3f}" for t in keyframe_times)]
+    return args
+
+def still_scale_filter(profile: Dict[str, Any]) -> str:
+    """Filter that fits a still into the profile frame size (letterboxed)"""
+    width, height = profile["width"], profile["height"]
+    return (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p"
+    )
+
+def segment_units(durations: List[float], profile: Dict[str, Any]) -> List[int]:
+    """Per-segment length in milliseconds (VFR) or frames (CFR).
+
+    Rounded on cumulative boundaries so the joined video never drifts from the audio.
+    """
+    rate = 1000 if profile["vfr"] else profile["fps"]
+    units = []
+    elapsed = 0.0
+    for duration in durations:
+        start = round(elapsed * rate)
+        elapsed += duration
+        units.append(max(1, round(elapsed * rate) - start))
+    return units
+
+def segment_timescale(profile: Dict[str, Any]) -> int:
+    """MP4 timescale shared by every segment so they can be joined with -c copy"""
+    return 1000 if profile["vfr"] else profile["fps"] * 512
+
+def hls_dir_for(output_path: str) -> str:
+    """Directory holding the HLS rendition of a rendered MP4"""
+    return os.path.join(os.path.dirname(output_path), "hls")
+
+def hls_output_args(hls_dir: str) -> List[str]:
+    """Muxer arguments that write an fMP4 HLS playlist and segments into hls_dir.
+
+    Segments are cut on keyframes, which our closed-GOP segments put on scene changes.
+    """
+    return [
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4",
+        "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", os.path.join(hls_dir, "segment_%04d.m4s"),
+        os.path.join(hls_dir, "index.m3u8"),
+    ]
+
+def reset_hls_dir(hls_dir: str) -> None:
+    """Start an HLS rendition from an empty directory (files may be hardlinks into a cache)"""
+    shutil.rmtree(hls_dir, ignore_errors=True)
+    os.makedirs(hls_dir)
+
+async def package_hls(mp4_path: str, hls_dir: str) -> None:
+    """Remux an existing MP4 into HLS without re-encoding"""
+    reset_hls_dir(hls_dir)
+    await run_ffmpeg(["ffmpeg", "-y", "-i", mp4_path, "-c", "copy"] + hls_output_args(hls_dir), cwd=hls_dir)
+
+def segment_cache_path(key_data: Dict[str, Any]) -> str:
+    """Where the segment cache keeps the segment described by key_data"""
+    key = hashlib.sha256(json.dumps({"version": RENDER_CACHE_VERSION, **key_data}, sort_keys=True).encode()).hexdigest()
+    return os.path.join(SEGMENT_CACHE_DIR, f"{key}.mp4")
+
+def segment_cache_lookup(cached_path: str, segment_path: str) -> bool:
+    """On a hit, place the cached segment at segment_path; otherwise clear segment_path for the encoder"""
+    if os.path.isfile(cached_path):
+        os.utime(cached_path)
+        link_or_copy(cached_path, segment_path)
+        return True
+    if os.path.exists(segment_path):
+        os.remove(segment_path)  # May be a hardlink into the cache
+    return False
+
+def segment_cache_store(segment_path: str, cached_path: str) -> None:
+    """Add a freshly encoded segment to the cache (evicted with the render cache)"""
+    try:
+        os.makedirs(SEGMENT_CACHE_DIR, exist_ok=True)
+        link_or_copy(segment_path, cached_path)
+    except OSError as e:
+        print(f"      ⚠️  Could not cache segment: {str(e)}")
+
+async def encode_still_segment(
+    image_file: str,
+    units: int,
+    profile: Dict[str, Any],
+    segment_path: str,
+    threads: int = 0,
+    movement: Optional[str] = None,
+    use_pool: bool = False
+) -> bool:
+    """Encode one still as an independent closed-GOP segment, reusing a cached one if possible.
+
+    With a motion profile the still gets the camera move named by movement
+    (a motion.py preset), rendered in a worker process if use_pool.
+    Returns True when the segment came from the cache.
+    """
+    cached_path = segment_cache_path({
+        "image": await asyncio.to_thread(file_sha256, image_file),
+        "units": units,
+        "profile": profile,
+        "movement": movement,
+    })
+    if segment_cache_lookup(cached_path, segment_path):
+        return True
+
+    if profile.get("motion"):
+        output_args = build_video_encode_args(profile)
+        if threads:
+            output_args += ["-threads", str(threads)]
+        output_args += ["-flags", "+cgop", "-video_track_timescale", str(segment_timescale(profile)), "-an"]
+        render_args = (
+            image_file, movement or "static", units, profile["width"], profile["height"],
+            profile["fps"], output_args, segment_path
+        )
+        if use_pool:
+            await asyncio.get_running_loop().run_in_executor(get_motion_pool(), motion.render_motion_segment, *render_args)
+        else:
+            await asyncio.to_thread(motion.render_motion_segment, *render_args)
+    else:
+        await encode_static_segment(image_file, units, profile, segment_path, threads)
+
+    segment_cache_store(segment_path, cached_path)
+    return False
+
+async def encode_static_segment(
+    image_file: str,
+    units: int,
+    profile: Dict[str, Any],
+    segment_path: str,
+    threads: int = 0
+) -> None:
+    """Encode a still that stays on screen unchanged for the segment"""
+    if profile["vfr"]:
+        # A single frame whose duration is the whole segment
+        input_args = ["-framerate", f"1000/{units}", "-i", image_file]
+        video_filter = still_scale_filter(profile)
+    else:
+        # Scale once, then clone the scaled frame instead of re-decoding the image
+        input_args = ["-framerate", str(profile["fps"]), "-i", image_file]
+        video_filter = still_scale_filter(profile) + f",tpad=stop_mode=clone:stop={units - 1}"
+
+    ffmpeg_cmd = ["ffmpeg", "-y"] + input_args + ["-vf", video_filter, "-frames:v", str(1 if profile["vfr"] else units)]
+    ffmpeg_cmd += build_video_encode_args(profile)
+    if threads:
+        ffmpeg_cmd += ["-threads", str(threads)]
+    ffmpeg_cmd += ["-flags", "+cgop", "-video_track_timescale", str(segment_timescale(profile)), "-an", segment_path]
+    await run_ffmpeg(ffmpeg_cmd, cwd=os.path.dirname(segment_path))
+
+async def concat_segments(
+    segment_files: List[str],
+    output_path: str,
+    profile: Dict[str, Any],
+    audio_path: Optional[str] = None,
+    scratch_dir: Optional[str] = None,
+    hls_dir: Optional[str] = None
+) -> None:
+    """Join encoded segments with a stream copy and mux the audio once.
+
+    With hls_dir, the same FFmpeg run also writes an HLS rendition.
+    """
+    work_dir = scratch_dir or os.path.dirname(output_path)
+    concat_file = os.path.join(work_dir, "concat.txt")
+    with open(concat_file, "w") as f:
+        for segment_file in segment_files:
+            f.write(f"file '{os.path.basename(segment_file)}'\n")
+
+    ffmpeg_cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_file]
+    stream_args = ["-map", "0:v", "-c:v", "copy"]
+    if audio_path:
+        ffmpeg_cmd += ["-i", audio_path]
+        stream_args += ["-map", "1:a", "-c:a", "aac", "-b:a", profile["audio_bitrate"], "-shortest"]
+    ffmpeg_cmd += stream_args + ["-movflags", "+faststart", output_path]
+    if hls_dir:
+        reset_hls_dir(hls_dir)
+        ffmpeg_cmd += stream_args + hls_output_args(hls_dir)
+
+    if os.path.exists(output_path):
+        os.remove(output_path)  # May be a hardlink into the render cache; never write through it
+    await run_ffmpeg(ffmpeg_cmd, cwd=work_dir)
+
+# Scene transitions: "smooth" (cross-dissolve) and "fade" (through black).
+# Only the short windows where one image turns into the next are rendered, as
+# their own cached CFR clips; the stills in between stay cached segments of
+# the profile (VFR included) and everything is joined with a stream copy, so
+# a transition costs a fixed, small amount on top of a cut render. Camera
+# motion needs continuous frames, so motion + transitions is one FFmpeg pass.
+# Each xfade starts on a scene boundary, so scenes still begin where the
+# timeline (and the audio) put them. Opt-in: every transition is an encode.
+TRANSITIONS_DEFAULT = os.getenv("TRANSITIONS", "false").lower() == "true"
+TRANSITION_SECONDS = float(os.getenv("TRANSITION_SECONDS", "0.5"))
+TRANSITION_XFADE = {"smooth": "fade", "fade": "fadeblack"}
+
+def normalize_transition(transition_type: Optional[str]) -> str:
+    """Map a timeline's free-text transition_type to smooth | fade | cut"""
+    text = (transition_type or "").lower()
+    if "cut" in text:
+        return "cut"
+    if "smooth" in text or "dissolve" in text or "cross" in text:
+        return "smooth"
+    if "fade" in text:
+        return "fade"
+    return "cut"
+
+def transition_seconds(durations: List[float]) -> float:
+    """Transition length, shortened so no scene is more than half transition"""
+    return min(TRANSITION_SECONDS, min(durations) / 2)
+
+def transition_pieces(durations: List[float], transition: str) -> List[tuple]:
+    """The timeline as consecutive (first, second, seconds) pieces.
+
+    first == second is image first held still; otherwise the piece is the
+    transition from image first to image second (None = black, for the fade
+    in and out of "fade"). Scene i's transition in takes the start of its time.
+    """
+    length = transition_seconds(durations)
+    fade = transition == "fade"
+    last = len(durations) - 1
+    pieces = [(None, 0, length)] if fade else []
+    for i, duration in enumerate(durations):
+        if i > 0:
+            pieces.append((i - 1, i, length))
+        hold = duration - (length if i > 0 or fade else 0) - (length if fade and i == last else 0)
+        if hold > 1e-6:
+            pieces.append((i, i, hold))
+    if fade:
+        pieces.append((last, None, length))
+    return pieces
+
+async def encode_transition_clip(
+    first: Optional[str],
+    second: Optional[str],
+    units: int,
+    profile: Dict[str, Any],
+    transition: str,
+    clip_path: str,
+    threads: int = 0
+) -> bool:
+    """Encode the window where image first turns into image second (None = black) as a segment.
+
+    units is the window length in the profile's segment units; VFR profiles get
+    it at motion_fps. Joins the cut segments with -c copy, so it uses their
+    encoder settings and timescale. Returns True when the clip came from the cache.
+    """
+    cached_path = segment_cache_path({
+        "transition": TRANSITION_XFADE[transition],
+        "first": await asyncio.to_thread(file_sha256, first) if first else None,
+        "second": await asyncio.to_thread(file_sha256, second) if second else None,
+        "units": units,
+        "profile": profile,
+    })
+    if segment_cache_lookup(cached_path, clip_path):
+        return True
+
+    if profile["vfr"]:
+        frames = max(1, round(units * profile["motion_fps"] / 1000))
+        rate, seconds = f"{frames * 1000}/{units}", units / 1000  # Exactly units milliseconds
+    else:
+        frames, rate, seconds = units, str(profile["fps"]), units / profile["fps"]
+    input_args, chains = [], []
+    for i, image_file in enumerate((first, second)):
+        if image_file:
+            # Scale once, then clone the scaled frame instead of re-decoding the image
+            input_args += ["-framerate", rate, "-i", image_file]
+            chains.append(f"[{i}:v]{still_scale_filter(profile)},tpad=stop_mode=clone:stop={frames - 1},settb=AVTB[s{i}]")
+        else:
+            input_args += ["-f", "lavfi", "-i", f"color=c=black:s={profile['width']}x{profile['height']}:r={rate}"]
+            chains.append(f"[{i}:v]setsar=1,format=yuv420p,settb=AVTB[s{i}]")
+    xfade = "fade" if first is None or second is None else TRANSITION_XFADE[transition]
+    chains.append(f"[s0][s1]xfade=transition={xfade}:duration={seconds:.6f}:offset=0[v]")
+
+    ffmpeg_cmd = ["ffmpeg", "-y"] + input_args + ["-filter_complex", ";".join(chains), "-map", "[v]"]
+    ffmpeg_cmd += ["-frames:v", str(frames)] + build_video_encode_args(profile)
+    if threads:
+        ffmpeg_cmd += ["-threads", str(threads)]
+    ffmpeg_cmd += ["-flags", "+cgop", "-video_track_timescale", str(segment_timescale(profile)), "-an", clip_path]
+    await run_ffmpeg(ffmpeg_cmd, cwd=os.path.dirname(clip_path))
+
+    segment_cache_store(clip_path, cached_path)
+    return False
+
+def slideshow_cache_key(
+    image_files: List[str],
+    durations: List[float],
+    profile: Dict[str, Any],
+    audio_path: Optional[str] = None,
+    movements: Optional[List[str]] = None,
+    transition: str = "cut"
+) -> str:
+    """Render cache key for encode_slideshow's output"""
+    extra = {"movements": movements}
+    if transition != "cut" and len(image_files) > 1:
+        extra.update(transition=transition, transition_seconds=transition_seconds(durations))
+    return render_cache_key(image_files, durations, profile, audio_path, extra)
+
+def build_transition_graph(
+    clip_filters: List[str],
+    units: List[int],
+    overlap: int,
+    fps: int,
+    transition: str
+) -> str:
+    """-filter_complex joining one input clip per scene with xfade.
+
+    Clip i is input i, already filtered to the output size, and is units[i]
+    frames long plus overlap frames (except the last), so the xfades eat
+    exactly the overlap and the output is sum(units) frames.
+    """
+    chains = [f"[{i}:v]{clip_filter}[s{i}]" for i, clip_filter in enumerate(clip_filters)]
+    duration = overlap / fps
+    previous = "s0"
+    for i in range(1, len(units)):
+        offset = sum(units[:i]) / fps
+        chains.append(
+            f"[{previous}][s{i}]xfade=transition={TRANSITION_XFADE[transition]}:"
+            f"duration={duration:.4f}:offset={offset:.4f}[x{i}]"
+        )
+        previous = f"x{i}"
+    if transition == "fade":
+        end = sum(units) / fps
+        chains.append(f"[{previous}]fade=t=in:d={duration:.4f},fade=t=out:st={end - duration:.4f}:d={duration:.4f}[v]")
+    else:
+        chains.append(f"[{previous}]null[v]")
+    return ";".join(chains)
+
+async def encode_transitions(
+    image_files: List[str],
+    durations: List[float],
+    output_path: str,
+    profile: Dict[str, Any],
+    transition: str,
+    audio_path: Optional[str] = None,
+    scratch_dir: Optional[str] = None,
+    movements: Optional[List[str]] = None
+) -> None:
+    """Encode a camera-motion timeline, transitions included, in one FFmpeg run.
+
+    The per-scene motion clips are rendered (or reused) from the segment cache
+    first and the graph only joins them. Without movements, stills are decoded
+    and scaled once and cloned for their duration.
+    """
+    work_dir = scratch_dir or os.path.dirname(output_path)
+    if profile["vfr"]:
+        profile = {**profile, "vfr": False, "fps": profile["motion_fps"]}  # Transitions need real frames
+    fps = profile["fps"]
+    units = segment_units(durations, profile)
+    overlap = max(1, round(transition_seconds(durations) * fps))
+    clip_units = [count + overlap for count in units[:-1]] + units[-1:]
+
+    if movements:
+        clip_files = [os.path.join(work_dir, f"clip_{i:04d}.mp4") for i in range(len(image_files))]
+        parallel = min(RENDER_MAX_PARALLEL, len(image_files))
+        threads = max(1, (os.cpu_count() or 1) // parallel)
+        use_pool = len(image_files) >= MOTION_POOL_MIN_SEGMENTS
+
+        async def render_clip(image_file: str, count: int, clip_file: str, movement: str) -> bool:
+            async with render_slots:
+                return await encode_still_segment(image_file, count, profile, clip_file, threads, movement, use_pool)
+
+        await asyncio.gather(*[
+            render_clip(*clip) for clip in zip(image_files, clip_units, clip_files, movements)
+        ])
+        input_args = [arg for clip_file in clip_files for arg in ("-i", clip_file)]
+        clip_filters = ["setsar=1,format=yuv420p,settb=AVTB"] * len(clip_files)
+    else:
+        input_args = [arg for image_file in image_files for arg in ("-framerate", str(fps), "-i", image_file)]
+        clip_filters = [
+            f"{still_scale_filter(profile)},tpad=stop_mode=clone:stop={count - 1},settb=AVTB"
+            for count in clip_units
+        ]
+
+    graph = build_transition_graph(clip_filters, units, overlap, fps, transition)
+    keyframe_times = [sum(units[:i]) / fps for i in range(1, len(units))]
+
+    ffmpeg_cmd = ["ffmpeg", "-y"] + input_args
+    stream_args = ["-map", "[v]"]
+    if audio_path:
+        ffmpeg_cmd += ["-i", audio_path]
+        stream_args += ["-map", f"{len(image_files)}:a", "-c:a", "aac", "-b:a", profile["audio_bitrate"], "-shortest"]
+    ffmpeg_cmd += ["-filter_complex", graph] + stream_args
+    ffmpeg_cmd += build_video_encode_args(profile, keyframe_times)
+    ffmpeg_cmd += ["-frames:v", str(sum(units)), "-movflags", "+faststart", output_path]
+
+    if os.path.exists(output_path):
+        os.remove(output_path)  # May be a hardlink into the render cache; never write through it
+    await run_ffmpeg(ffmpeg_cmd, cwd=work_dir)
+
+async def encode_slideshow(
+    image_files: List[str],
+    durations: List[float],
+    output_path: str,
+    profile: Dict[str, Any],
+    audio_path: Optional[str] = None,
+    scratch_dir: Optional[str] = None,
+    hls: bool = False,
+    movements: Optional[List[str]] = None,
+    transition: str = "cut"
+) -> str:
+    """Encode still images (shown for the given durations) into an MP4, optionally with audio.
+
+    Every image is encoded as its own cached segment and the segments are joined
+    with a stream copy, so replacing one image only re-encodes one short segment.
+    Segments and the concat list go to scratch_dir (default: next to the output).
+    With hls, an HLS rendition is written to hls_dir_for(output_path) as well.
+    With a motion profile, movements holds each image's camera move preset.
+    A transition other than "cut" adds cached transition clips between the
+    segments (see transition_pieces); with movements it renders the timeline
+    with encode_transitions instead.
+    """
+    start = time.time()
+    work_dir = scratch_dir or os.path.dirname(output_path)
+    hls_dir = hls_dir_for(output_path) if hls else None
+    movements = movements if profile.get("motion") else None
+
+    # Hashing every input and walking the cache are blocking disk work: keep them off the event loop
+    cache_key = await asyncio.to_thread(slideshow_cache_key, image_files, durations, profile, audio_path, movements, transition)
+    if await asyncio.to_thread(render_cache_lookup, cache_key, output_path):
+        print(f"      ⚡ Render cache hit ({profile['name']} profile), skipping encode")
+        if hls_dir:
+            await package_hls(output_path, hls_dir)
+        return output_path
+
+    if len(image_files) < 2:
+        transition = "cut"
+    metric_name = f"render_{render_metric_name(profile, transition)}_seconds_per_frame"
+    if transition != "cut" and movements:
+        print(f"      🎞️  Encoding {len(image_files)} scenes with camera motion and '{transition}' transitions in one pass "
+              f"('{profile['name']}' profile, {profile['width']}x{profile['height']}, crf {profile['crf']})")
+        await encode_transitions(image_files, durations, output_path, profile, transition, audio_path, work_dir, movements)
+        if hls_dir:
+            await package_hls(output_path, hls_dir)
+        await asyncio.to_thread(render_cache_store, cache_key, output_path)
+        metric_observe(metric_name, (time.time() - start) / len(image_files))
+        return output_path
+
+    # Segments split the timeline at scene boundaries; encode them concurrently
+    # and give each FFmpeg its share of the cores
+    parallel = min(RENDER_MAX_PARALLEL, len(image_files))
+    threads = max(1, (os.cpu_count() or 1) // parallel)
+
+    rate = "vfr" if profile["vfr"] else f"{profile['fps']}fps" + (" with camera motion" if movements else "")
+    extra = f", '{transition}' transitions" if transition != "cut" else ""
+    print(f"      🎞️  Encoding {len(image_files)} segments with '{profile['name']}' profile "
+          f"({profile['width']}x{profile['height']} @ {rate}, crf {profile['crf']}{extra}, {parallel} in parallel)")
+
+    if transition == "cut":
+        pieces = [(i, i, duration) for i, duration in enumerate(durations)]
+    else:
+        pieces = transition_pieces(durations, transition)
+    segment_files = [os.path.join(work_dir, f"segment_{i:04d}.mp4") for i in range(len(pieces))]
+
+    use_pool = bool(movements) and len(image_files) >= MOTION_POOL_MIN_SEGMENTS
+
+    async def encode_segment(piece: tuple, units: int, segment_path: str) -> bool:
+        first, second, _ = piece
+        async with render_slots:
+            if first == second:
+                movement = movements[first] if movements else None
+                return await encode_still_segment(image_files[first], units, profile, segment_path, threads, movement, use_pool)
+            return await encode_transition_clip(
+                image_files[first] if first is not None else None,
+                image_files[second] if second is not None else None,
+                units, profile, transition, segment_path, threads
+            )
+
+    reused = await asyncio.gather(*[
+        encode_segment(piece, units, segment_path)
+        for piece, units, segment_path in zip(
+            pieces, segment_units([seconds for _, _, seconds in pieces], profile), segment_files
+        )
+    ])
+
+    print(f"      ♻️  Reused {sum(reused)}/{len(segment_files)} cached segments")
+    await concat_segments(segment_files, output_path, profile, audio_path, work_dir, hls_dir)
+    await asyncio.to_thread(render_cache_store, cache_key, output_path)
+    metric_observe(metric_name, (time.time() - start) / len(image_files))
+    return output_path
+
+# ============================================================================
+# VIDEO PREVIEWS
+# ============================================================================
+
+# A poster, a sprite sheet of evenly spaced thumbnails and a small JSON index
+# of scene boundaries, built from the source stills (never by decoding the
+# video) so the UI can scrub without downloading the whole video.
+PREVIEW_POSTER_WIDTH = 1280
+SPRITE_TILE_WIDTH = 160
+SPRITE_COLUMNS = 10
+SPRITE_MAX_TILES = 100
+SPRITE_MIN_INTERVAL = 1.0  # seconds between thumbnails
+
+def build_video_previews(
+    image_files: List[str],
+    durations: List[float],
+    labels: List[str],
+    profile: Dict[str, Any],
+    output_dir: str
+) -> Dict[str, str]:
+    """Write poster.jpg, sprite.jpg and index.json for a rendered slideshow into output_dir"""
+    aspect = profile["width"] / profile["height"]
+    poster_size = (min(PREVIEW_POSTER_WIDTH, profile["width"]), round(min(PREVIEW_POSTER_WIDTH, profile["width"]) / aspect))
+    tile_size = (SPRITE_TILE_WIDTH, round(SPRITE_TILE_WIDTH / aspect))
+
+    starts = [0.0]
+    for duration in durations:
+        starts.append(starts[-1] + duration)
+    total_duration = starts[-1]
+
+    # Decode each still once, straight to thumbnail size
+    tiles = []
+    for i, image_file in enumerate(image_files):
+        with Image.open(image_file) as image:
+            image = image.convert("RGB")
+            if i == 0:
+                ImageOps.pad(image, poster_size).save(os.path.join(output_dir, "poster.jpg"), quality=85)
+            image.thumbnail((tile_size[0] * 2, tile_size[1] * 2))
+            tiles.append(ImageOps.pad(image, tile_size))
+
+    # A thumbnail every `interval` seconds shows whichever still is on screen then
+    count = max(1, min(SPRITE_MAX_TILES, int(total_duration // SPRITE_MIN_INTERVAL)))
+    interval = total_duration / count
+    columns = min(SPRITE_COLUMNS, count)
+    rows = -(-count // columns)
+    sprite = Image.new("RGB", (columns * tile_size[0], rows * tile_size[1]))
+    for k in range(count):
+        scene = min(bisect.bisect_right(starts, k * interval) - 1, len(tiles) - 1)
+        sprite.paste(tiles[scene], ((k % columns) * tile_size[0], (k // columns) * tile_size[1]))
+    sprite.save(os.path.join(output_dir, "sprite.jpg"), quality=75)
+
+    # URLs in the index are relative to index.json, like the HLS playlist
+    index = {
+        "duration": round(total_duration, 3),
+        "width": profile["width"],
+        "height": profile["height"],
+        "poster": "poster.jpg",
+        "sprite": {
+            "url": "sprite.jpg",
+            "tile_width": tile_size[0],
+            "tile_height": tile_size[1],
+            "columns": columns,
+            "count": count,
+            "interval": round(interval, 3),
+        },
+        "scenes": [
+            {
+                "index": i,
+                "start": round(starts[i], 3),
+                "end": round(starts[i + 1], 3),
+                "label": label[:200],
+                "tile": min(count - 1, math.ceil(round(starts[i] / interval, 6))),  # First tile inside the scene
+            }
+            for i, label in enumerate(labels)
+        ],
+    }
+    with open(os.path.join(output_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+
+    return {
+        "poster_url": artifact_url(os.path.join(output_dir, "poster.jpg")),
+        "sprite_url": artifact_url(os.path.join(output_dir, "sprite.jpg")),
+        "index_url": artifact_url(os.path.join(output_dir, "index.json")),
+    }
+
+async def create_video_previews(
+    image_files: List[str],
+    durations: List[float],
+    labels: List[str],
+    profile: Dict[str, Any],
+    output_dir: str
+) -> Optional[Dict[str, str]]:
+    """Build previews in a worker thread; a failure here never fails the render"""
+    try:
+        return await asyncio.to_thread(build_video_previews, image_files, durations, labels, profile, output_dir)
+    except Exception as e:
+        print(f"      ⚠️  Could not build video previews: {str(e)}")
+        return None
+
+# ============================================================================
+# TWO-PHASE RENDER JOBS
+# ============================================================================
+
+# A low-res proxy is returned immediately, the full-quality render runs in the
+# background and the job status reports when it is ready.
+TWO_PHASE_RENDER_DEFAULT = os.getenv("TWO_PHASE_RENDER", "false").lower() == "true"
+RENDER_JOB_TTL_SECONDS = 3600
+
+render_jobs: Dict[str, Dict[str, Any]] = {}
+background_render_tasks = set()  # Strong references so tasks are not garbage collected
+
+def create_render_job(kind: str, profile_name: str) -> Dict[str, Any]:
+    """Register a new render job and drop jobs that have expired"""
+    now = time.time()
+    for job_id in [j for j, job in render_jobs.items() if now - job["updated_at"] > RENDER_JOB_TTL_SECONDS]:
+        del render_jobs[job_id]
+
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "kind": kind,
+        "status": "rendering_proxy",
+        "profile": profile_name,
+        "proxy_url": None,
+        "final_url": None,
+        "video_url": None,  # Best version available right now
+        "hls_url": None,  # HLS playlist of the final render, when requested
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    render_jobs[job["job_id"]] = job
+    return job
+
+def update_render_job(job: Dict[str, Any], **changes) -> None:
+    """Apply changes to a render job and bump its timestamp"""
+    job.update(changes)
+    job["updated_at"] = time.time()
+
+async def render_two_phase(
+    kind: str,
+    image_files: List[str],
+    durations: List[float],
+    output_path: str,
+    profile: Dict[str, Any],
+    audio_path: Optional[str] = None,
+    workspace: Optional[JobWorkspace] = None,
+    hls: bool = False,
+    movements: Optional[List[str]] = None,
+    transition: str = "cut"
+) -> Dict[str, Any]:
+    """Encode a proxy now and schedule the full-quality encode in the background.
+
+    The workspace (if given) is finished once the final render is done, since
+    the background encode still needs its scratch files. Only the final render
+    gets an HLS rendition and the transitions; the proxy is cut.
+    """
+    job = create_render_job(kind, profile["name"])
+    scratch_dir = workspace.scratch_dir if workspace else None
+    hls_url = artifact_url(os.path.join(hls_dir_for(output_path), "index.m3u8")) if hls else None
+
+    # Already rendered at full quality: no need for a proxy
+    movements = movements if profile.get("motion") else None
+    cache_key = await asyncio.to_thread(slideshow_cache_key, image_files, durations, profile, audio_path, movements, transition)
+    if await asyncio.to_thread(render_cache_lookup, cache_key, output_path):
+        try:
+            if hls:
+                await package_hls(output_path, hls_dir_for(output_path))
+        finally:
+            if workspace:
+                workspace.finish()
+        final_url = artifact_url(output_path)
+        update_render_job(job, status="final_ready", final_url=final_url, video_url=final_url, hls_url=hls_url)
+        print(f"      ⚡ Render cache hit, final video ready immediately")
+        return dict(job)
+
+    proxy_path = output_path.replace(".mp4", "_proxy.mp4")
+    proxy_start = time.time()
+    try:
+        await encode_slideshow(image_files, durations, proxy_path, PROXY_RENDER_PROFILE, audio_path, scratch_dir)
+    except Exception as e:
+        update_render_job(job, status="failed", error=str(e))
+        if workspace:
+            workspace.finish()
+        raise
+    proxy_url = artifact_url(proxy_path)
+    update_render_job(job, status="proxy_ready", proxy_url=proxy_url, video_url=proxy_url)
+    print(f"      ⚡ Proxy ready in {time.time() - proxy_start:.1f}s, final render continues in background")
+
+    async def render_final():
+        try:
+            await encode_slideshow(image_files, durations, output_path, profile, audio_path, scratch_dir, hls, movements, transition)
+            final_url = artifact_url(output_path)
+            update_render_job(job, status="final_ready", final_url=final_url, video_url=final_url, hls_url=hls_url)
+            print(f"      ✅ Final render ready for job {job['job_id']}")
+        except Exception as e:
+            # The proxy is still playable, so keep it as the video_url
+            update_render_job(job, status="final_failed", error=str(e))
+            print(f"      ❌ Final render failed for job {job['job_id']}: {str(e)}")
+        finally:
+            if workspace:
+                workspace.finish()
+
+    task = asyncio.create_task(render_final())
+    background_render_tasks.add(task)
+    task.add_done_callback(background_render_tasks.discard)
+
+    return dict(job)
+
+@app.get("/api/render-jobs/{job_id}")
+async def get_render_job(job_id: str):
+    """Report the status of a two-phase render (proxy_ready -> final_ready)"""
+    job = render_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Render job not found")
+    return job
+
+async def assemble_video_from_frames(
+    frame_images: List[Dict[str, Any]],
+    timeline: VideoTimeline,
+    prompt: str = "",
+    render_profile: Optional[str] = None,
+    two_phase: bool = False,
+    hls: bool = False,
+    motion_render: bool = False,
+    transitions: bool = False
+) -> Dict[str, Any]:
+    """Download frame images and assemble into video using FFmpeg.
+
+    With motion_render, each keyframe gets a pan/zoom matching its timeline
+    camera_movement instead of being held still. With transitions, the
+    timeline's transition_type joins the keyframes (otherwise they cut).
+    Returns {"video_url": ...} plus a "render_job" when rendering in two phases
+    and an "hls_url" when an HLS rendition was requested (and is ready).
+    """
+    workspace = None
+    render_job = None  # Once set, the background render owns the workspace
+    try:
+        # Unique workspace for this video
+        workspace = await JobWorkspace.create("video")
         
-        print(f"      📁 Created video directory: {video_dir}")
+        print(f"      📁 Created video directory: {workspace.dir}")
         
         # Save prompt to file
-        prompt_file = os.path.join(video_dir, "prompt.txt")
+        prompt_file = workspace.path("prompt.txt")
         with open(prompt_file, "w", encoding="utf-8") as f:
             f.write(f"Original Prompt:\n{prompt}\n\n")
             f.write(f"Timeline:\n")
@@ -474,10 +1614,22 @@ async def assemble_video_from_frames(frame_images: List[Dict[str, Any]], timelin
         
         # Download each frame image
         print(f"      ⬇️  Downloading {len(frame_images)} frames...")
+        frame_paths = {}  # frame_number -> downloaded file
         async with httpx.AsyncClient(timeout=60.0) as client:
             for i, frame_data in enumerate(frame_images):
                 frame_url = frame_data["url"]
-                frame_path = os.path.join(video_dir, f"frame_{i:04d}.png")
+                frame_path = workspace.scratch(f"frame_{i:04d}.png")
+                frame_paths[frame_data["frame_number"]] = frame_path
+                
+                # Near-duplicates come from an earlier frame's file instead of a download
+                source_path = frame_paths.get(frame_data.get("derived_from"))
+                if source_path:
+                    if frame_data.get("variant"):
+                        await asyncio.to_thread(derive_frame_variant, source_path, frame_path, frame_data["variant"])
+                    else:
+                        shutil.copyfile(source_path, frame_path)
+                    print(f"         Frame {i+1}/{len(frame_images)} derived from frame {frame_data['derived_from'] + 1}")
+                    continue
                 
                 response = await client.get(frame_url)
                 response.raise_for_status()
@@ -491,75 +1643,74 @@ async def assemble_video_from_frames(frame_images: List[Dict[str, Any]], timelin
         
         # Calculate frame duration (how long each frame shows)
         frame_duration = timeline.total_duration / len(frame_images)
-        output_fps = 30  # Output video FPS
+        profile = get_render_profile(render_profile)
+        movements = None
+        if motion_render:
+            profile = motion_profile(profile)
+            camera_movements = {frame.frame_number: frame.camera_movement for frame in timeline.frames}
+            movements = [
+                motion.motion_preset_for(camera_movements.get(frame_data["frame_number"]))
+                for frame_data in frame_images
+            ]
         
         print(f"      🎬 Assembling video...")
         print(f"         Frames: {len(frame_images)}")
         print(f"         Duration: {timeline.total_duration}s")
         print(f"         Frame duration: {frame_duration}s each")
-        print(f"         Output FPS: {output_fps}")
+        print(f"         Render profile: {profile['name']}")
+        if movements:
+            print(f"         Camera motion: {', '.join(movements)}")
+        transition = normalize_transition(timeline.transition_type) if transitions else "cut"
+        print(f"         Transitions: {transition}")
         
         # Output video path
-        output_path = os.path.join(video_dir, "video.mp4")
-        
-        # Create concat file for FFmpeg (Windows-compatible)
-        concat_file = os.path.join(video_dir, "concat.txt")
-        with open(concat_file, "w") as f:
-            for i in range(len(frame_images)):
-                frame_path = f"frame_{i:04d}.png"
-                f.write(f"file '{frame_path}'\n")
-                f.write(f"duration {frame_duration}\n")
-            # Repeat last frame to ensure proper duration
-            f.write(f"file 'frame_{len(frame_images)-1:04d}.png'\n")
-        
-        print(f"      📝 Created concat file with {len(frame_images)} frames")
-        
-        # Create video using FFmpeg with concat demuxer
-        ffmpeg_cmd = [
-            "ffmpeg",
-            "-y",  # Overwrite output
-            "-f", "concat",  # Use concat demuxer
-            "-safe", "0",  # Allow any file paths
-            "-i", concat_file,  # Input concat file
-            "-vf", f"fps={output_fps}",  # Output FPS
-            "-c:v", "libx264",
-            "-pix_fmt", "yuv420p",
-            "-preset", "fast",
-            output_path
-        ]
+        output_path = workspace.path("video.mp4")
         
-        # Run FFmpeg
-        result = subprocess.run(
-            ffmpeg_cmd,
-            capture_output=True,
-            text=True,
-            cwd=video_dir
-        )
+        frame_files = [workspace.scratch(f"frame_{i:04d}.png") for i in range(len(frame_images))]
+        durations = [frame_duration] * len(frame_files)
         
-        if result.returncode != 0:
-            print(f"      ❌ FFmpeg error: {result.stderr}")
-            raise Exception(f"FFmpeg failed: {result.stderr}")
+        labels = [frame_data.get("description", "") for frame_data in frame_images]
         
-        print(f"      ✅ Video assembled successfully")
+        if two_phase:
+            # Previews first: the workspace's scratch frames go away with the final render
+            previews = await create_video_previews(frame_files, durations, labels, profile, workspace.dir)
+            render_job = await render_two_phase(
+                "video", frame_files, durations, output_path, profile, workspace=workspace, hls=hls,
+                movements=movements, transition=transition
+            )
+            print(f"      ✅ Proxy video available at {render_job['proxy_url']}")
+            return {"video_url": render_job["video_url"], "render_job": render_job, "previews": previews}
+        
+        _, previews = await asyncio.gather(
+            encode_slideshow(
+                frame_files, durations, output_path, profile, scratch_dir=workspace.scratch_dir, hls=hls,
+                movements=movements, transition=transition
+            ),
+            create_video_previews(frame_files, durations, labels, profile, workspace.dir)
+        )
+        workspace.finish()
         
-        # Read video file and convert to base64 data URL
-        with open(output_path, "rb") as f:
-            video_data = f.read()
+        print(f"      ✅ Video assembled successfully")
         
-        video_base64 = base64.b64encode(video_data).decode('utf-8')
-        video_data_url = f"data:video/mp4;base64,{video_base64}"
+        # Serve the file from the artifact store instead of inlining it
+        video_url = artifact_url(output_path)
         
-        print(f"      ✅ Video encoded as data URL ({len(video_data)} bytes)")
+        print(f"      ✅ Video available at {video_url} ({os.path.getsize(output_path)} bytes)")
         print(f"      💾 Video saved to: {output_path}")
         
-        return video_data_url
+        assembly = {"video_url": video_url, "previews": previews}
+        if hls:
+            assembly["hls_url"] = artifact_url(os.path.join(hls_dir_for(output_path), "index.m3u8"))
+        return assembly
         
     except Exception as e:
         print(f"      ❌ Video assembly failed: {str(e)}")
+        if workspace and render_job is None:
+            workspace.finish()
         # Fallback: return first frame URL
         if frame_images:
             print(f"      ⚠️  Falling back to first frame as static image")
-            return frame_images[0]["url"]
+            return {"video_url": frame_images[0]["url"]}
         raise Exception(f"Video assembly failed: {str(e)}")
 
 async def analyze_prompt_category(prompt: str) -> CategoryResponse:
@@ -660,7 +1811,18 @@ async def poll_bria_status(status_url: str, max_attempts: int = 60, delay: int =
     raise HTTPException(status_code=500, detail="BRIA generation timeout - took too long")
 
 async def call_bria_api(category: str, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
-    """Call appropriate BRIA API based on category"""
+    """Call appropriate BRIA API based on category, recording queue depth and latency"""
+    metric_inc("bria_in_flight")
+    start = time.time()
+    try:
+        result = await submit_bria_request(category, prompt, params)
+    finally:
+        metric_inc("bria_in_flight", -1)
+    metric_observe(f"bria_{category}_seconds", time.time() - start)
+    return result
+
+async def submit_bria_request(category: str, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Submit a BRIA request and poll until it completes"""
     
     # Demo mode - return placeholder
     if DEMO_MODE:
@@ -973,6 +2135,243 @@ Return ONLY valid JSON, no markdown."""
             }
         }
 
+# ============================================================================
+# VIDEO PLANS
+# ============================================================================
+
+# The Gemini part of a multi-frame video (context, timeline, one rewritten
+# prompt per frame). /api/preview-video-prompts stores its plan under a token
+# so /api/generate can go straight to frame generation instead of asking
+# Gemini again. Plans expire and are bound to the exact prompt text.
+VIDEO_PLAN_TTL_SECONDS = int(os.getenv("VIDEO_PLAN_TTL_SECONDS", "1800"))
+
+video_plans: Dict[str, Dict[str, Any]] = {}
+
+async def plan_video_frames(prompt: str, duration: float = 10.0, num_frames: int = 8) -> Dict[str, Any]:
+    """Extract the shared context, build the timeline and write each frame's prompt"""
+    start = time.time()
+    print("   🎯 Extracting consistent video context...")
+    video_context = await extract_video_context(prompt)
+    print(f"   ✅ Context extracted:")
+    print(f"      Background: {video_context.background[:60]}...")
+    print(f"      Lighting: {video_context.lighting_style}")
+    print(f"      Color Palette: {video_context.color_palette}")
+
+    print("   📋 Analyzing prompt with Gemini to create timeline...")
+    timeline = await analyze_video_timeline(prompt, duration=duration, num_frames=num_frames)
+    print(f"   ✅ Timeline created: {timeline.total_frames} frames over {timeline.total_duration}s")
+    print(f"   Style: {timeline.overall_style}, Transitions: {timeline.transition_type}")
+
+    # Add context to timeline
+    timeline.background_description = video_context.background
+    timeline.character_description = ", ".join(video_context.characters)
+    timeline.color_palette = video_context.color_palette
+
+    print("   ✍️  Rewriting prompts for consistency...")
+    frame_prompts = []
+    for frame in timeline.frames:
+        if VIDEO_CONSISTENCY_ENABLED:
+            frame_prompt = await rewrite_frame_prompt_for_consistency(
+                frame.description,
+                video_context,
+                frame.frame_number,
+                timeline.total_frames
+            )
+        else:
+            # Build detailed prompt for this frame (old method)
+            frame_prompt = frame.description
+            if frame.camera_movement:
+                frame_prompt += f", {frame.camera_movement} camera"
+            if frame.lighting:
+                frame_prompt += f", {frame.lighting} lighting"
+            if frame.action:
+                frame_prompt += f", {frame.action}"
+        frame_prompts.append(frame_prompt)
+
+    metric_observe("video_planning_seconds", time.time() - start)
+    return {"context": video_context, "timeline": timeline, "frame_prompts": frame_prompts}
+
+def prompt_fingerprint(prompt: str) -> str:
+    """Hash of the prompt a plan was made for"""
+    return hashlib.sha256(prompt.strip().encode("utf-8")).hexdigest()
+
+def store_video_plan(prompt: str, plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep a plan for later generation and drop expired ones"""
+    now = time.time()
+    for token in [t for t, stored in video_plans.items() if stored["expires_at"] <= now]:
+        del video_plans[token]
+
+    stored = {
+        "token": uuid.uuid4().hex,
+        "prompt_hash": prompt_fingerprint(prompt),
+        "expires_at": now + VIDEO_PLAN_TTL_SECONDS,
+        "plan": plan,
+    }
+    video_plans[stored["token"]] = stored
+    return stored
+
+def get_video_plan(token: str, prompt: str) -> Dict[str, Any]:
+    """Look up a stored plan, checking expiry and that the prompt has not changed"""
+    stored = video_plans.get(token)
+    if not stored or stored["expires_at"] <= time.time():
+        video_plans.pop(token, None)
+        raise HTTPException(status_code=410, detail="Video plan not found or expired, preview the prompts again")
+    if stored["prompt_hash"] != prompt_fingerprint(prompt):
+        raise HTTPException(status_code=409, detail="Prompt changed since the preview, preview the prompts again")
+    plan = stored["plan"]
+    # Frame generation mutates nothing, but hand out a copy of the timeline anyway
+    return {**plan, "timeline": plan["timeline"].model_copy(deep=True)}
+
+# ============================================================================
+# FRAME DEDUPE
+# ============================================================================
+
+# Gemini timelines often contain near-identical shots. With a shared seed,
+# BRIA would render nearly the same image again, so a frame whose rewritten
+# prompt is close enough to an earlier one (Jaccard similarity of the word
+# sets) is not submitted. It either reuses the earlier image or, by default,
+# gets a slightly zoomed crop of it so the shot still moves.
+FRAME_DEDUPE_THRESHOLD = float(os.getenv("FRAME_DEDUPE_THRESHOLD", "0.85"))  # > 1 disables
+FRAME_DEDUPE_VARIANT = os.getenv("FRAME_DEDUPE_VARIANT", "zoom").lower()  # zoom | reuse
+FRAME_VARIANT_ZOOM_STEP = 0.06
+
+PROMPT_STOP_WORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "at", "to", "with", "by", "for", "from",
+    "is", "are", "its", "it", "as", "this", "that", "into", "while", "frame", "scene",
+}
+
+def prompt_tokens(prompt: str) -> set:
+    """Lowercase content words of a prompt"""
+    return {token for token in re.findall(r"[a-z0-9']+", prompt.lower()) if token not in PROMPT_STOP_WORDS}
+
+def find_duplicate_frames(frame_prompts: List[str], threshold: float) -> Dict[int, Dict[str, Any]]:
+    """Map each near-duplicate frame index to the earlier unique frame it can be derived from"""
+    token_sets = [prompt_tokens(prompt) for prompt in frame_prompts]
+    duplicates = {}
+    for i in range(len(token_sets)):
+        best_source, best_similarity = None, 0.0
+        for j in range(i):
+            if j in duplicates or not token_sets[i] or not token_sets[j]:
+                continue  # Only unique frames are sources
+            similarity = len(token_sets[i] & token_sets[j]) / len(token_sets[i] | token_sets[j])
+            if similarity > best_similarity:
+                best_source, best_similarity = j, similarity
+        if best_source is not None and best_similarity >= threshold:
+            duplicates[i] = {"source": best_source, "similarity": round(best_similarity, 3)}
+    return duplicates
+
+def derive_frame_variant(source_path: str, output_path: str, variant: int) -> None:
+    """Write a zoomed-in crop of a frame (variant n zooms n steps, drifting sideways)"""
+    with Image.open(source_path) as image:
+        width, height = image.size
+        zoom = 1 + FRAME_VARIANT_ZOOM_STEP * variant
+        crop_width, crop_height = round(width / zoom), round(height / zoom)
+        # Alternate the drift direction so consecutive variants do not all slide one way
+        drift = (width - crop_width) // 4 * (1 if variant % 2 else -1)
+        left = (width - crop_width) // 2 + drift
+        top = (height - crop_height) // 2
+        image.crop((left, top, left + crop_width, top + crop_height)).resize((width, height), Image.LANCZOS).save(output_path)
+
+# ============================================================================
+# VIDEO BUDGET PLANNER
+# ============================================================================
+
+# Picks the number of keyframes, the render profile and the BRIA concurrency
+# so a video fits a latency budget. Estimates are the moving averages in
+# /api/metrics, with priors until something has been observed. BRIA requests
+# already in flight leave fewer free slots, so under load a video gets fewer
+# keyframes instead of timing out.
+VIDEO_LATENCY_BUDGET_SECONDS = float(os.getenv("VIDEO_LATENCY_BUDGET_SECONDS", "180"))
+VIDEO_MIN_FRAMES = 3
+VIDEO_MAX_FRAMES = 8
+VIDEO_DURATION_SECONDS = 10.0
+BRIA_MAX_CONCURRENCY = int(os.getenv("BRIA_MAX_CONCURRENCY", "4"))
+
+LATENCY_PRIORS = {
+    "bria_image_seconds": 15.0,
+    "video_planning_seconds": 20.0,  # Context, timeline and all frame rewrites
+}
+RENDER_SECONDS_PER_FRAME_PRIORS = {
+    "proxy": 0.1, "preview": 0.15, "standard": 0.45, "archival": 3.0,
+    "preview_motion": 0.8, "standard_motion": 4.0, "archival_motion": 8.0,
+    "preview_transitions": 0.7, "standard_transitions": 3.0, "archival_transitions": 11.0,
+    "preview_motion_transitions": 1.2, "standard_motion_transitions": 6.0, "archival_motion_transitions": 14.0,
+}
+
+def estimated_seconds(name: str) -> float:
+    """Smoothed observed latency, or its prior"""
+    return metrics.get(f"{name}_ewma", LATENCY_PRIORS.get(name, 0.0))
+
+def estimated_render_seconds(profile_name: str, num_frames: int) -> float:
+    """Expected encode time for a slideshow of num_frames stills"""
+    per_frame = metrics.get(
+        f"render_{profile_name}_seconds_per_frame_ewma",
+        RENDER_SECONDS_PER_FRAME_PRIORS.get(profile_name, 1.0)
+    )
+    return per_frame * num_frames
+
+def plan_video_budget(
+    budget_seconds: Optional[float] = None,
+    num_frames: Optional[int] = None,
+    render_profile: Optional[str] = None,
+    two_phase: bool = False,
+    planned: bool = False,
+    motion_render: bool = False,
+    transitions: bool = False
+) -> Dict[str, Any]:
+    """Choose keyframe count, render profile and concurrency for a latency budget.
+
+    num_frames / render_profile fix those choices (e.g. from a stored plan or
+    the user); planned means the Gemini planning has already been done.
+    motion_render / transitions price the final render with camera motion / transitions.
+    """
+    budget_seconds = budget_seconds or VIDEO_LATENCY_BUDGET_SECONDS
+    in_flight = int(metrics.get("bria_in_flight", 0))
+    free_slots = max(1, BRIA_MAX_CONCURRENCY - in_flight)
+    frame_seconds = estimated_seconds("bria_image_seconds")
+    planning_seconds = 0.0 if planned else estimated_seconds("video_planning_seconds")
+
+    frame_choices = [num_frames] if num_frames else range(VIDEO_MAX_FRAMES, VIDEO_MIN_FRAMES - 1, -1)
+    if render_profile:
+        profile_choices = [get_render_profile(render_profile)["name"]]
+    else:
+        profile_choices = list(dict.fromkeys([get_render_profile(None)["name"], "preview"]))
+
+    def estimate(frames: int, profile_name: str) -> float:
+        waves = math.ceil(frames / min(free_slots, frames))
+        # Two-phase renders return after the proxy; the final render is not waited for
+        if two_phase:
+            render_seconds = estimated_render_seconds("proxy", frames)
+        else:
+            render_name = profile_name + ("_motion" if motion_render else "") + ("_transitions" if transitions else "")
+            render_seconds = estimated_render_seconds(render_name, frames)
+        return planning_seconds + waves * frame_seconds + render_seconds
+
+    # Most keyframes first, then the best profile that still fits
+    choice = None
+    for frames in frame_choices:
+        for profile_name in profile_choices:
+            if estimate(frames, profile_name) <= budget_seconds:
+                choice = (frames, profile_name)
+                break
+        if choice:
+            break
+    fits_budget = choice is not None
+    if not choice:
+        choice = (frame_choices[-1], profile_choices[-1])
+
+    frames, profile_name = choice
+    return {
+        "budget_seconds": budget_seconds,
+        "num_frames": frames,
+        "render_profile": profile_name,
+        "concurrency": min(free_slots, frames),
+        "estimated_seconds": round(estimate(frames, profile_name), 1),
+        "fits_budget": fits_budget,
+        "bria_in_flight": in_flight,
+        "frame_seconds": round(frame_seconds, 2),
+    }
+
 @app.post("/api/preview-video-prompts")
 async def preview_video_prompts(request: GenerateRequest):
     """Preview rewritten prompts for video generation without actually generating"""
@@ -987,27 +2386,18 @@ async def preview_video_prompts(request: GenerateRequest):
         
         print(f"🔍 Previewing video prompts for: {prompt[:50]}...")
         
-        # Step 1: Extract consistent context
-        print("   🎯 Extracting video context...")
-        video_context = await extract_video_context(prompt)
-        
-        # Step 2: Create timeline
-        print("   📋 Creating timeline...")
-        timeline = await analyze_video_timeline(prompt, duration=10.0, num_frames=8)
+        motion_render = MOTION_RENDER_DEFAULT if request.motion is None else request.motion
+        transitions = TRANSITIONS_DEFAULT if request.transitions is None else request.transitions
+        budget = plan_video_budget(
+            request.latency_budget_seconds, render_profile=request.render_profile,
+            motion_render=motion_render, transitions=transitions
+        )
+        plan = await plan_video_frames(prompt, duration=VIDEO_DURATION_SECONDS, num_frames=budget["num_frames"])
+        video_context = plan["context"]
+        timeline = plan["timeline"]
         
-        # Step 3: Rewrite prompts for each frame
-        print("   ✍️  Rewriting prompts for consistency...")
         rewritten_frames = []
-        
-        for frame in timeline.frames:
-            # Rewrite prompt
-            rewritten = await rewrite_frame_prompt_for_consistency(
-                frame.description,
-                video_context,
-                frame.frame_number,
-                timeline.total_frames
-            )
-            
+        for frame, rewritten in zip(timeline.frames, plan["frame_prompts"]):
             rewritten_frames.append({
                 "frame_number": frame.frame_number,
                 "timestamp": frame.timestamp,
@@ -1020,6 +2410,9 @@ async def preview_video_prompts(request: GenerateRequest):
         
         print(f"   ✅ Generated {len(rewritten_frames)} rewritten prompts")
         
+        # Let /api/generate reuse this plan instead of asking Gemini again
+        stored = store_video_plan(prompt, plan)
+        
         return {
             "context": {
                 "background": video_context.background,
@@ -1036,13 +2429,91 @@ async def preview_video_prompts(request: GenerateRequest):
                 "overall_style": timeline.overall_style,
                 "transition_type": timeline.transition_type
             },
-            "frames": rewritten_frames
+            "frames": rewritten_frames,
+            "plan_token": stored["token"],
+            "plan_expires_at": stored["expires_at"],
+            "budget_plan": budget
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error previewing prompts: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============================================================================
+# SPECULATIVE GENERATION
+# ============================================================================
+
+# Most prompts are routed to "image", so the BRIA image request can be
+# submitted while Gemini is still analyzing the category. The policy names
+# the categories that may use the speculative result; for any other category
+# the request is cancelled (BRIA may still finish a job it already accepted)
+# and counted as wasted work. Only categories whose BRIA request is identical
+# to the speculative one may be covered, so using it never changes the result.
+SPECULATIVE_POLICIES = {
+    "off": set(),
+    "image": {"image"},
+}
+SPECULATIVE_POLICY = os.getenv("SPECULATIVE_GENERATION", "off").lower()
+
+def get_speculative_policy(name: Optional[str]) -> set:
+    """Categories that may keep a speculative image (None = configured default)"""
+    name = (name or SPECULATIVE_POLICY).lower()
+    if name not in SPECULATIVE_POLICIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown speculative policy '{name}'. Choose one of: {', '.join(SPECULATIVE_POLICIES)}"
+        )
+    return SPECULATIVE_POLICIES[name]
+
+def start_speculative_image(prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Submit the BRIA image request in the background"""
+    speculation = {"started_at": time.time(), "finished_at": None}
+
+    async def generate():
+        try:
+            return await call_bria_api("image", prompt, params)
+        finally:
+            speculation["finished_at"] = time.time()  # Set before any awaiter resumes
+
+    speculation["task"] = asyncio.create_task(generate())
+    metric_inc("speculative_started")
+    print(f"🔮 Speculatively submitted image generation")
+    return speculation
+
+async def resolve_speculative_image(speculation: Dict[str, Any], category: str, keep: set) -> Optional[Dict[str, Any]]:
+    """Return the speculative result if the category may use it, otherwise cancel it.
+
+    Returns None when the caller has to run the real request.
+    """
+    task = speculation["task"]
+    overlap = time.time() - speculation["started_at"]  # Time spent in parallel with routing
+
+    if category in keep:
+        try:
+            result = await task
+        except Exception as e:
+            metric_inc("speculative_failed")
+            print(f"🔮 Speculative image failed, generating normally: {str(e)}")
+            return None
+        saved = min(overlap, speculation["finished_at"] - speculation["started_at"])
+        metric_inc("speculative_kept")
+        metric_inc("speculative_saved_seconds", saved)
+        print(f"🔮 Using speculative image for '{category}' ({saved:.1f}s saved)")
+        return result
+
+    if task.done():
+        if not task.cancelled() and task.exception() is None:
+            metric_inc("speculative_wasted_generations")  # BRIA finished a whole image for nothing
+    else:
+        task.cancel()
+        metric_inc("speculative_cancelled")
+    metric_inc("speculative_discarded")
+    metric_inc("speculative_wasted_seconds", overlap)
+    print(f"🔮 Discarded speculative image, category is '{category}'")
+    return None
+
 @app.post("/api/generate")
 async def generate_content(request: GenerateRequest):
     """Generate content using Gemini routing + BRIA APIs"""
@@ -1055,8 +2526,28 @@ async def generate_content(request: GenerateRequest):
         else:
             raise HTTPException(status_code=400, detail="Either prompt or structured_prompt is required")
         
+        params = {
+            "aspect_ratio": request.aspect_ratio,
+            "seed": request.seed,
+            "guidance_scale": request.guidance_scale,
+            "num_inference_steps": request.num_inference_steps,
+            "tailored_model_id": request.tailored_model_id,
+            "image_url": request.image_url,
+        }
+        speculative_result = None
+        
+        # A plan from /api/preview-video-prompts already did the Gemini work
+        video_plan = get_video_plan(request.plan_token, prompt) if request.plan_token else None
+        
         # Step 1: Determine category (manual override or Gemini analysis)
-        if request.force_category:
+        if video_plan and request.force_category in (None, "video"):
+            print(f"🗺️  Using video plan {request.plan_token[:8]} from preview")
+            category_result = CategoryResponse(
+                category="video",
+                confidence=1.0,
+                reasoning="Video plan from prompt preview"
+            )
+        elif request.force_category:
             # User manually selected category
             print(f"🎯 Manual category selected: {request.force_category}")
             category_result = CategoryResponse(
@@ -1065,97 +2556,143 @@ async def generate_content(request: GenerateRequest):
                 reasoning="Manually selected by user"
             )
         else:
-            # Use Gemini to analyze
+            # Use Gemini to analyze, optionally generating the image at the same time
+            keep_speculative = get_speculative_policy(request.speculative_policy)
+            speculation = start_speculative_image(prompt, params) if keep_speculative else None
             print(f"🤖 Analyzing prompt with Gemini: {prompt[:50]}...")
             category_result = await analyze_prompt_category(prompt)
             print(f"Category: {category_result.category} (confidence: {category_result.confidence})")
+            if speculation:
+                speculative_result = await resolve_speculative_image(
+                    speculation, category_result.category, keep_speculative
+                )
         
         # Step 2: Handle video generation (multi-frame workflow)
         if category_result.category == "video" and not request.image_url:
             print("🎬 Video generation: Using ENHANCED multi-frame workflow with AI consistency")
             
-            # Step 2a: Extract consistent context from prompt
-            print("   🎯 Step 1/5: Extracting consistent video context...")
-            video_context = await extract_video_context(prompt)
-            print(f"   ✅ Context extracted:")
-            print(f"      Background: {video_context.background[:60]}...")
-            print(f"      Lighting: {video_context.lighting_style}")
-            print(f"      Color Palette: {video_context.color_palette}")
-            
-            # Step 2b: Analyze prompt and create timeline with Gemini
-            print("   📋 Step 2/5: Analyzing prompt with Gemini to create timeline...")
-            timeline = await analyze_video_timeline(prompt, duration=10.0, num_frames=8)  # 8 frames over 10 seconds
-            print(f"   ✅ Timeline created: {timeline.total_frames} frames over {timeline.total_duration}s")
-            print(f"   Style: {timeline.overall_style}, Transitions: {timeline.transition_type}")
-            
-            # Add context to timeline
-            timeline.background_description = video_context.background
-            timeline.character_description = ", ".join(video_context.characters)
-            timeline.color_palette = video_context.color_palette
+            # Fit keyframes, render profile and concurrency to the latency budget
+            # (also validates the render profile before any generation calls)
+            two_phase = TWO_PHASE_RENDER_DEFAULT if request.two_phase is None else request.two_phase
+            motion_render = MOTION_RENDER_DEFAULT if request.motion is None else request.motion
+            transitions = TRANSITIONS_DEFAULT if request.transitions is None else request.transitions
+            budget = plan_video_budget(
+                request.latency_budget_seconds,
+                num_frames=len(video_plan["frame_prompts"]) if video_plan else None,
+                render_profile=request.render_profile,
+                two_phase=two_phase,
+                planned=video_plan is not None,
+                motion_render=motion_render,
+                transitions=transitions
+            )
+            print(f"   ⏱️  Budget {budget['budget_seconds']:.0f}s: {budget['num_frames']} keyframes, "
+                  f"'{budget['render_profile']}' profile, {budget['concurrency']} at a time "
+                  f"(~{budget['estimated_seconds']:.0f}s, {budget['bria_in_flight']} BRIA requests in flight)")
+            
+            # Step 2a-b: Context, timeline and per-frame prompts (reused from the preview if possible)
+            if video_plan:
+                print("   🗺️  Steps 1-2/5: Reusing context, timeline and prompts from the preview")
+            else:
+                print("   🎯 Steps 1-2/5: Planning frames with Gemini...")
+                video_plan = await plan_video_frames(
+                    prompt, duration=VIDEO_DURATION_SECONDS, num_frames=budget["num_frames"]
+                )
+            timeline = video_plan["timeline"]
             
             # Step 2c: Generate image for each frame with consistency
             print(f"   🎨 Step 3/5: Generating {timeline.total_frames} consistent images...")
             frame_images = []
             
-            for frame in timeline.frames:
-                print(f"      Frame {frame.frame_number + 1}/{timeline.total_frames}: {frame.description[:60]}...")
-                
-                # Rewrite frame prompt for consistency
-                if VIDEO_CONSISTENCY_ENABLED:
-                    frame_prompt = await rewrite_frame_prompt_for_consistency(
-                        frame.description,
-                        video_context,
-                        frame.frame_number,
-                        timeline.total_frames
-                    )
-                else:
-                    # Build detailed prompt for this frame (old method)
-                    frame_prompt = frame.description
-                    if frame.camera_movement:
-                        frame_prompt += f", {frame.camera_movement} camera"
-                    if frame.lighting:
-                        frame_prompt += f", {frame.lighting} lighting"
-                    if frame.action:
-                        frame_prompt += f", {frame.action}"
-                
-                print(f"      📝 Consistent prompt: {frame_prompt[:80]}...")
-                
-                # Generate image for this frame
-                params_frame = {
-                    "aspect_ratio": request.aspect_ratio or "16:9",
-                    "seed": request.seed,  # Use SAME seed for consistency
-                    "guidance_scale": request.guidance_scale,
-                    "num_inference_steps": request.num_inference_steps,
-                }
-                
-                frame_result = await call_bria_api("image", frame_prompt, params_frame)
+            # Near-identical prompts with the same seed would give near-identical images
+            dedupe_threshold = FRAME_DEDUPE_THRESHOLD if request.dedupe_threshold is None else request.dedupe_threshold
+            duplicates = {}
+            if request.seed is not None:
+                duplicates = find_duplicate_frames(video_plan["frame_prompts"], dedupe_threshold)
+            dedupe_report = {"threshold": dedupe_threshold, "bria_calls": 0, "bria_calls_saved": 0, "duplicates": []}
+            
+            params_frame = {
+                "aspect_ratio": request.aspect_ratio or "16:9",
+                "seed": request.seed,  # Use SAME seed for consistency
+                "guidance_scale": request.guidance_scale,
+                "num_inference_steps": request.num_inference_steps,
+            }
+            frame_slots = asyncio.Semaphore(budget["concurrency"])
+            
+            async def generate_frame(index: int) -> Optional[str]:
+                frame = timeline.frames[index]
+                async with frame_slots:
+                    print(f"      Frame {frame.frame_number + 1}/{timeline.total_frames}: {frame.description[:60]}...")
+                    frame_result = await call_bria_api("image", video_plan["frame_prompts"][index], params_frame)
+                dedupe_report["bria_calls"] += 1
                 
                 # Extract image URL
                 frame_url = None
                 if "result" in frame_result and isinstance(frame_result["result"], dict):
                     frame_url = frame_result["result"].get("image_url")
-                
-                if not frame_url:
-                    print(f"      ⚠️  Failed to generate frame {frame.frame_number}, skipping")
+                if frame_url:
+                    print(f"      ✅ Frame {frame.frame_number + 1} generated with consistency")
+                return frame_url
+            
+            # Unique frames are generated concurrently; a duplicate whose source
+            # failed is generated itself in a second round
+            frame_urls = {}
+            pending = [i for i in range(len(timeline.frames)) if i not in duplicates]
+            while pending:
+                frame_urls.update(zip(pending, await asyncio.gather(*[generate_frame(i) for i in pending])))
+                pending = [i for i, d in duplicates.items() if i not in frame_urls and not frame_urls.get(d["source"])]
+            
+            generated = {}  # Frame index -> frame_images entry of frames BRIA actually rendered
+            variants = {}  # Source index -> number of frames derived from it so far
+            for index, (frame, frame_prompt) in enumerate(zip(timeline.frames, video_plan["frame_prompts"])):
+                if index in frame_urls:
+                    if not frame_urls[index]:
+                        print(f"      ⚠️  Failed to generate frame {frame.frame_number}, skipping")
+                        continue
+                    frame_images.append({
+                        "frame_number": frame.frame_number,
+                        "url": frame_urls[index],
+                        "timestamp": frame.timestamp,
+                        "description": frame.description,
+                        "consistent_prompt": frame_prompt
+                    })
+                    generated[index] = frame_images[-1]
                     continue
                 
+                duplicate = duplicates[index]
+                source = generated[duplicate["source"]]
+                variants[duplicate["source"]] = variants.get(duplicate["source"], 0) + 1
                 frame_images.append({
                     "frame_number": frame.frame_number,
-                    "url": frame_url,
+                    "url": source["url"],
                     "timestamp": frame.timestamp,
                     "description": frame.description,
-                    "consistent_prompt": frame_prompt
+                    "consistent_prompt": frame_prompt,
+                    "derived_from": source["frame_number"],
+                    "variant": variants[duplicate["source"]] if FRAME_DEDUPE_VARIANT == "zoom" else 0,
+                })
+                dedupe_report["bria_calls_saved"] += 1
+                dedupe_report["duplicates"].append({
+                    "frame": frame.frame_number,
+                    "source": source["frame_number"],
+                    "similarity": duplicate["similarity"],
                 })
-                print(f"      ✅ Frame {frame.frame_number + 1} generated with consistency")
+                print(f"      ♻️  Frame {frame.frame_number + 1} is a near-duplicate of frame "
+                      f"{source['frame_number'] + 1} (similarity {duplicate['similarity']}), skipped BRIA")
             
             if not frame_images:
                 raise HTTPException(status_code=500, detail="Failed to generate any frames")
             
-            print(f"   ✅ Generated {len(frame_images)} consistent frames successfully")
+            metric_inc("frame_dedupe_bria_calls_saved", dedupe_report["bria_calls_saved"])
+            print(f"   ✅ Generated {len(frame_images)} consistent frames successfully "
+                  f"({dedupe_report['bria_calls']} BRIA calls, {dedupe_report['bria_calls_saved']} saved by dedupe)")
             
             # Step 2d: Download and assemble frames into video
             print(f"   🎞️  Step 4/5: Assembling frames into video with FFmpeg...")
-            video_url = await assemble_video_from_frames(frame_images, timeline, prompt)
+            hls = HLS_OUTPUT_DEFAULT if request.hls is None else request.hls
+            assembly = await assemble_video_from_frames(
+                frame_images, timeline, prompt, budget["render_profile"], two_phase, hls, motion_render, transitions
+            )
+            video_url = assembly["video_url"]
             
             print(f"   ✅ Video assembled successfully!")
             
@@ -1168,24 +2705,23 @@ async def generate_content(request: GenerateRequest):
                 "timeline": timeline.model_dump(),
                 "frames_generated": len(frame_images),
                 "method": "multi-frame-assembly",
-                "video_available": True
+                "video_available": True,
+                "frame_dedupe": dedupe_report,
+                "budget_plan": budget
             }
+            for key in ("render_job", "hls_url", "previews"):
+                if key in assembly:
+                    bria_result[key] = assembly[key]
             
             print("   ✅ Multi-frame video generation complete!")
             
         else:
             # Step 2: Call appropriate BRIA API (standard flow)
-            params = {
-                "aspect_ratio": request.aspect_ratio,
-                "seed": request.seed,
-                "guidance_scale": request.guidance_scale,
-                "num_inference_steps": request.num_inference_steps,
-                "tailored_model_id": request.tailored_model_id,
-                "image_url": request.image_url,
-            }
-            
-            print(f"Calling BRIA {category_result.category} API...")
-            bria_result = await call_bria_api(category_result.category, prompt, params)
+            if speculative_result is not None:
+                bria_result = speculative_result
+            else:
+                print(f"Calling BRIA {category_result.category} API...")
+                bria_result = await call_bria_api(category_result.category, prompt, params)
         
         # Step 3: Format response - handle BRIA v2 API response structure
         # After polling, BRIA returns the final result with the image URL
@@ -1261,12 +2797,24 @@ async def generate_content(request: GenerateRequest):
             response_data["frames_generated"] = bria_result["frames_generated"]
         if "method" in bria_result:
             response_data["method"] = bria_result["method"]
+        if "render_job" in bria_result:
+            response_data["render_job"] = bria_result["render_job"]
+        if "frame_dedupe" in bria_result:
+            response_data["frame_dedupe"] = bria_result["frame_dedupe"]
+        if "budget_plan" in bria_result:
+            response_data["budget_plan"] = bria_result["budget_plan"]
+        if "hls_url" in bria_result:
+            response_data["hls_url"] = bria_result["hls_url"]
+        if "previews" in bria_result:
+            response_data["previews"] = bria_result["previews"]
         
         print(f"📤 Sending response with image.url: {response_data['image']['url'][:100]}...")
         if "timeline" in response_data:
             print(f"   📹 Video data included: {response_data.get('frames_generated', 0)} frames")
         return response_data
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating content: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1343,6 +2891,10 @@ class MusicAnalysis(BaseModel):
     genre: str
     key_moments: List[float]
     description: str
+    brightness: Optional[float] = None  # Mean spectral centroid (Hz), with librosa only
+    analyzed_seconds: Optional[float] = None  # How much of the track librosa analyzed
+    audio_id: Optional[str] = None  # SHA-256 of the uploaded audio (analysis cache key)
+    cached: bool = False
 
 class MusicStory(BaseModel):
     title: str
@@ -1362,9 +2914,12 @@ class MusicStoryRequest(BaseModel):
     key_moments: List[float]
     description: str
     content_type: Optional[str] = "music-video"
+    audio_id: Optional[str] = None  # From /api/music/analyze: scenes start at the track's section changes
+    num_scenes: Optional[int] = None  # Defaults to len(key_moments)
 
 class YouTubeDownloadRequest(BaseModel):
     url: str
+    include_audio_data: bool = True  # False: only audio_url/audio_id, no base64 copy of the file
 
 class YouTubeTranscriptRequest(BaseModel):
     url: str
@@ -1372,104 +2927,191 @@ class YouTubeTranscriptRequest(BaseModel):
 class LyricVideoRequest(BaseModel):
     url: str
     style: Optional[str] = "modern"
+    render_profile: Optional[str] = None  # preview | standard | archival
+    two_phase: Optional[bool] = None  # Return a low-res proxy first, final render in background
+    hls: Optional[bool] = None  # Also write an HLS rendition (fMP4 segments + playlist)
 
 class YouTubeVideoInfoRequest(BaseModel):
     url: str
 
+# ============================================================================
+# YOUTUBE AUDIO CACHE
+# ============================================================================
+
+# Downloaded audio is kept under generated_videos/youtube_cache/<video id>/
+# (the file as YouTube serves it, plus info.json), so it can be served as an
+# artifact and every later request for the video - download, lyric video,
+# analysis by artifact id - reuses it. yt-dlp runs in a worker thread; all
+# concurrent requests for one video share a single download. Directory
+# mtime is the LRU timestamp.
+YOUTUBE_CACHE_DIR = os.path.join(GENERATED_VIDEOS_DIR, "youtube_cache")
+YOUTUBE_CACHE_MAX_BYTES = int(os.getenv("YOUTUBE_CACHE_MAX_MB", "2048")) * 1024 * 1024
+YOUTUBE_CACHE_VERSION = 1
+YOUTUBE_INLINE_MAX_BYTES = 50 * 1024 * 1024  # Largest audio returned inline as base64
+YOUTUBE_VIDEO_ID_PATTERN = re.compile(r"(?:[?&]v=|youtu\.be/|/(?:shorts|embed|live|v)/)([0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])")
+youtube_downloads: Dict[str, asyncio.Task] = {}  # Video id -> download in progress
+
+def youtube_video_id(url: str) -> Optional[str]:
+    """The 11-character video id of a YouTube URL"""
+    if not any(domain in url for domain in ['youtube.com', 'youtu.be']):
+        return None
+    match = YOUTUBE_VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def youtube_cache_lookup(video_id: str) -> Optional[Dict[str, Any]]:
+    """Cached audio entry for a video (with its "path"), marking it recently used"""
+    directory = os.path.join(YOUTUBE_CACHE_DIR, video_id)
+    try:
+        with open(os.path.join(directory, "info.json"), encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    path = os.path.join(directory, entry.get("filename", ""))
+    if entry.get("version") != YOUTUBE_CACHE_VERSION or not os.path.isfile(path):
+        return None
+    os.utime(directory)
+    return {**entry, "path": path}
+
+def download_youtube_audio_file(video_id: str) -> Dict[str, Any]:
+    """Download a video's audio into the cache with yt-dlp (runs in a worker thread)"""
+    import yt_dlp
+    
+    os.makedirs(YOUTUBE_CACHE_DIR, exist_ok=True)
+    directory = os.path.join(YOUTUBE_CACHE_DIR, video_id)
+    temp_dir = os.path.join(YOUTUBE_CACHE_DIR, f".{video_id}.{uuid.uuid4().hex}.tmp")
+    os.makedirs(temp_dir)
+    try:
+        # The audio stream as served (AAC/Opus): no MP3 transcode, FFmpeg reads it anyway
+        ydl_opts = {
+            'format': 'bestaudio[ext=m4a]/bestaudio/best',
+            'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
+            'noplaylist': True,
+            'quiet': True,
+            'no_warnings': True,
+            'writethumbnail': False,
+            'writeinfojson': False,
+        }
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
+        
+        audio_files = [f for f in os.listdir(temp_dir) if f.startswith("audio.") and not f.endswith(".part")]
+        if not audio_files:
+            raise Exception(f"No audio file found after download. Files: {os.listdir(temp_dir)}")
+        path = os.path.join(temp_dir, audio_files[0])
+        entry = {
+            "version": YOUTUBE_CACHE_VERSION,
+            "video_id": video_id,
+            "title": info.get('title', 'Unknown'),
+            "duration": info.get('duration', 0),
+            "uploader": info.get('uploader', 'Unknown'),
+            "filename": audio_files[0],
+            "file_size": os.path.getsize(path),
+            "audio_id": file_sha256(path),  # Same key as the analysis cache
+            "created_at": datetime.now().isoformat(),
+        }
+        with open(os.path.join(temp_dir, "info.json"), "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        
+        # Publish the complete entry in one rename
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(temp_dir, directory)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    
+    try:
+        evict_youtube_cache(keep=video_id)
+    except OSError as e:
+        print(f"⚠️  YouTube cache eviction failed: {str(e)}")
+    return {**entry, "path": os.path.join(directory, entry["filename"])}
+
+def evict_youtube_cache(keep: Optional[str] = None) -> None:
+    """Delete least recently used downloads until the cache fits its budget"""
+    entries = []
+    for entry in os.scandir(YOUTUBE_CACHE_DIR):
+        if entry.is_dir() and not entry.name.startswith(".") and entry.name != keep:
+            entries.append((entry.stat().st_mtime, directory_size(entry.path), entry.path))
+    
+    total = sum(size for _, size, _ in entries)
+    if keep:
+        total += directory_size(os.path.join(YOUTUBE_CACHE_DIR, keep))  # The new download stays
+    for _, size, path in sorted(entries):
+        if total <= YOUTUBE_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        print(f"🧹 Evicted cached YouTube audio {os.path.basename(path)}")
+
+async def fetch_youtube_audio(url: str) -> Dict[str, Any]:
+    """Cached audio for a YouTube URL, downloaded once on a miss however many requests ask"""
+    video_id = youtube_video_id(url)
+    if not video_id:
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    
+    entry = youtube_cache_lookup(video_id)
+    if entry:
+        metric_inc("youtube_cache_hits")
+        print(f"⚡ YouTube audio cache hit for {video_id}")
+        return {**entry, "cached": True}
+    
+    task = youtube_downloads.get(video_id)
+    if task is None:
+        metric_inc("youtube_cache_misses")
+        print(f"📥 Downloading YouTube audio {video_id}...")
+        task = asyncio.ensure_future(asyncio.to_thread(download_youtube_audio_file, video_id))
+        youtube_downloads[video_id] = task
+        task.add_done_callback(lambda _: youtube_downloads.pop(video_id, None))
+    else:
+        metric_inc("youtube_downloads_coalesced")
+        print(f"⏳ Waiting for the download of {video_id} already in progress")
+    # Shielded: one client giving up must not cancel the download for the others
+    entry = await asyncio.shield(task)
+    return {**entry, "cached": False}
+
+def read_audio_data_url(path: str) -> str:
+    """A cached audio file as a base64 data URL"""
+    mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as f:
+        return f"data:{mime_type};base64,{base64.b64encode(f.read()).decode('utf-8')}"
+
 @app.post("/api/music/download-youtube")
 async def download_youtube_audio(request: YouTubeDownloadRequest):
-    """Download audio from YouTube URL"""
+    """Download audio from YouTube URL (cached by video id)"""
     try:
         print(f"🎵 Downloading audio from YouTube: {request.url}")
         
-        # Validate URL format
-        if not any(domain in request.url for domain in ['youtube.com', 'youtu.be']):
-            raise HTTPException(status_code=400, detail="Invalid YouTube URL")
-        
-        # Create temp directory
-        temp_dir = tempfile.mkdtemp()
-        print(f"📁 Created temp directory: {temp_dir}")
-        
         try:
-            import yt_dlp
-            print("✅ yt-dlp imported successfully")
-            
-            # Configure yt-dlp options with better error handling
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
-                'quiet': False,  # Enable logging for debugging
-                'no_warnings': False,
-                'extract_flat': False,
-                'writethumbnail': False,
-                'writeinfojson': False,
-            }
-            
-            print("🔧 Configured yt-dlp options")
-            
-            # Download audio
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                print("📥 Starting download...")
-                info = ydl.extract_info(request.url, download=True)
-                title = info.get('title', 'Unknown')
-                duration = info.get('duration', 0)
-                uploader = info.get('uploader', 'Unknown')
-                print(f"📋 Video info: {title} by {uploader} ({duration}s)")
-            
-            # Find the downloaded file (it might have a different name)
-            audio_files = [f for f in os.listdir(temp_dir) if f.endswith('.mp3')]
-            if not audio_files:
-                # Try other audio formats
-                audio_files = [f for f in os.listdir(temp_dir) if f.endswith(('.mp3', '.m4a', '.webm', '.ogg'))]
-            
-            if not audio_files:
-                raise Exception(f"No audio file found in {temp_dir}. Files: {os.listdir(temp_dir)}")
-            
-            audio_file_path = os.path.join(temp_dir, audio_files[0])
-            print(f"📄 Found audio file: {audio_files[0]}")
-            
-            # Read the downloaded file
-            with open(audio_file_path, "rb") as f:
-                audio_data = f.read()
-            
-            print(f"📊 Audio file size: {len(audio_data)} bytes")
-            
-            # Convert to base64 (limit size for response)
-            if len(audio_data) > 50 * 1024 * 1024:  # 50MB limit
-                raise Exception("Audio file too large (>50MB)")
-            
-            audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-            
-            # Cleanup
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            
-            print(f"✅ Downloaded: {title} ({duration}s)")
-            
-            return {
-                "success": True,
-                "title": title,
-                "duration": duration,
-                "uploader": uploader,
-                "audio_data": f"data:audio/mp3;base64,{audio_base64}",
-                "file_size": len(audio_data)
-            }
-            
+            entry = await fetch_youtube_audio(request.url)
         except ImportError as e:
             print(f"❌ Import error: {str(e)}")
             raise HTTPException(
                 status_code=500, 
                 detail=f"yt-dlp not available: {str(e)}"
             )
-        except Exception as e:
-            print(f"❌ Download error: {str(e)}")
-            # Cleanup on error
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            raise e
+        
+        print(f"📊 Audio file size: {entry['file_size']} bytes")
+        
+        # Inline copy for older clients; audio_url streams the same file with Range support
+        audio_data = None
+        if request.include_audio_data:
+            if entry["file_size"] > YOUTUBE_INLINE_MAX_BYTES:
+                raise Exception("Audio file too large (>50MB), use audio_url")
+            audio_data = await asyncio.to_thread(read_audio_data_url, entry["path"])
+        
+        print(f"✅ Downloaded: {entry['title']} ({entry['duration']}s)")
+        
+        return {
+            "success": True,
+            "title": entry["title"],
+            "duration": entry["duration"],
+            "uploader": entry["uploader"],
+            "audio_data": audio_data,
+            "audio_url": artifact_url(entry["path"]),
+            "audio_id": entry["audio_id"],
+            "video_id": entry["video_id"],
+            "cached": entry["cached"],
+            "file_size": entry["file_size"]
+        }
         
     except HTTPException:
         raise
@@ -1676,12 +3318,16 @@ Return ONLY the formatted lyrics, nothing else. Make it look professional."""
 @app.post("/api/music/generate-lyric-video")
 async def generate_lyric_video(request: LyricVideoRequest):
     """Generate complete lyric video from YouTube URL"""
+    workspace = None
+    render_job = None  # Once set, the background render owns the workspace
     try:
         print(f"🎬 Generating lyric video from: {request.url}")
         
+        profile = get_render_profile(request.render_profile)
+        
         # Step 1: Download audio
         print("   📥 Step 1/5: Downloading audio...")
-        audio_result = await download_youtube_audio(YouTubeDownloadRequest(url=request.url))
+        audio_result = await fetch_youtube_audio(request.url)
         
         # Step 2: Get transcript
         print("   📝 Step 2/5: Extracting lyrics...")
@@ -1803,19 +3449,11 @@ Respond in JSON format:
         print(f"   🎞️  Step 5/5: Assembling lyric video...")
         
         # Create output directory
-        output_base = os.path.join(os.getcwd(), "generated_videos")
-        os.makedirs(output_base, exist_ok=True)
+        workspace = await JobWorkspace.create("lyric_video")
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        video_dir = os.path.join(output_base, f"lyric_video_{timestamp}")
-        os.makedirs(video_dir, exist_ok=True)
-        
-        # Save audio
-        audio_data = audio_result["audio_data"].split(',')[1]
-        audio_bytes = base64.b64decode(audio_data)
-        audio_path = os.path.join(video_dir, "audio.mp3")
-        with open(audio_path, "wb") as f:
-            f.write(audio_bytes)
+        # Use the cached download directly (hardlinked, so cache eviction cannot remove it mid-render)
+        audio_path = workspace.scratch(f"audio{os.path.splitext(audio_result['path'])[1]}")
+        await asyncio.to_thread(link_or_copy, audio_result["path"], audio_path)
         
         # Download images
         async with httpx.AsyncClient(timeout=60.0) as client:
@@ -1828,63 +3466,36 @@ Respond in JSON format:
                     response.raise_for_status()
                     image_data = response.content
                 
-                image_path = os.path.join(video_dir, f"bg_{i:04d}.png")
+                image_path = workspace.scratch(f"bg_{i:04d}.png")
                 with open(image_path, "wb") as f:
                     f.write(image_data)
         
-        # Create video from images
-        concat_file = os.path.join(video_dir, "concat.txt")
-        with open(concat_file, "w") as f:
-            for i, section in enumerate(section_images):
-                duration = section["end"] - section["start"]
-                f.write(f"file 'bg_{i:04d}.png'\n")
-                f.write(f"duration {duration}\n")
-            # Repeat last frame
-            f.write(f"file 'bg_{len(section_images)-1:04d}.png'\n")
-        
-        # Create video
-        video_no_audio = os.path.join(video_dir, "video_no_audio.mp4")
-        ffmpeg_cmd = [
-            "ffmpeg", "-y",
-            "-f", "concat",
-            "-safe", "0",
-            "-i", concat_file,
-            "-vf", "fps=30,scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2",
-            "-c:v", "libx264",
-            "-pix_fmt", "yuv420p",
-            "-preset", "fast",
-            video_no_audio
-        ]
-        
-        result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True, cwd=video_dir)
-        if result.returncode != 0:
-            raise Exception(f"Video creation failed: {result.stderr}")
-        
-        # Add audio
-        output_path = os.path.join(video_dir, "lyric_video.mp4")
-        ffmpeg_audio_cmd = [
-            "ffmpeg", "-y",
-            "-i", video_no_audio,
-            "-i", audio_path,
-            "-c:v", "copy",
-            "-c:a", "aac",
-            "-shortest",
-            output_path
-        ]
-        
-        result = subprocess.run(ffmpeg_audio_cmd, capture_output=True, text=True, cwd=video_dir)
-        if result.returncode != 0:
-            raise Exception(f"Audio merge failed: {result.stderr}")
-        
-        # Convert to base64
-        with open(output_path, "rb") as f:
-            video_data = f.read()
-        
-        video_base64 = base64.b64encode(video_data).decode('utf-8')
-        video_url = f"data:video/mp4;base64,{video_base64}"
+        # Create video from images with the audio muxed in the same pass
+        output_path = workspace.path("lyric_video.mp4")
+        image_files = [workspace.scratch(f"bg_{i:04d}.png") for i in range(len(section_images))]
+        durations = [section["end"] - section["start"] for section in section_images]
+        hls_url = None
+        hls = HLS_OUTPUT_DEFAULT if request.hls is None else request.hls
+        use_two_phase = TWO_PHASE_RENDER_DEFAULT if request.two_phase is None else request.two_phase
+        labels = [section["lyrics"] for section in section_images]
+        if use_two_phase:
+            previews = await create_video_previews(image_files, durations, labels, profile, workspace.dir)
+            render_job = await render_two_phase(
+                "lyric_video", image_files, durations, output_path, profile, audio_path, workspace, hls
+            )
+            video_url = render_job["video_url"]
+        else:
+            _, previews = await asyncio.gather(
+                encode_slideshow(image_files, durations, output_path, profile, audio_path, workspace.scratch_dir, hls),
+                create_video_previews(image_files, durations, labels, profile, workspace.dir)
+            )
+            workspace.finish()
+            video_url = artifact_url(output_path)
+            if hls:
+                hls_url = artifact_url(os.path.join(hls_dir_for(output_path), "index.m3u8"))
         
         # Save lyrics file
-        lyrics_file = os.path.join(video_dir, "lyrics.txt")
+        lyrics_file = workspace.path("lyrics.txt")
         with open(lyrics_file, "w", encoding="utf-8") as f:
             f.write(f"Title: {audio_result['title']}\n")
             f.write(f"Artist: {audio_result['uploader']}\n\n")
@@ -1895,107 +3506,327 @@ Respond in JSON format:
         return {
             "success": True,
             "video_url": video_url,
+            "artifact_id": artifact_id_for(output_path),
+            "render_job": render_job,
+            "hls_url": hls_url,
+            "previews": previews,
             "file_path": output_path,
             "title": audio_result["title"],
             "artist": audio_result["uploader"],
             "duration": audio_result["duration"],
+            "audio_id": audio_result["audio_id"],
             "sections": len(section_images),
             "lyrics": formatted_lyrics,
             "lyric_sections": section_images
         }
         
+    except HTTPException:
+        if workspace and render_job is None:
+            workspace.finish()
+        raise
     except Exception as e:
         print(f"❌ Lyric video generation error: {str(e)}")
+        if workspace and render_job is None:
+            workspace.finish()
         raise HTTPException(status_code=500, detail=f"Lyric video generation failed: {str(e)}")
 
-@app.post("/api/music/analyze")
-async def analyze_music(file: UploadFile = File(...)):
-    """Analyze uploaded music file for mood, tempo, and characteristics"""
+# ============================================================================
+# MUSIC ANALYSIS POOL
+# ============================================================================
+
+# librosa analysis is seconds of CPU-bound DSP, so it runs in its own process
+# pool (audio_analysis.py) instead of on the event loop. Workers import
+# librosa and JIT-compile numba at startup, each task is cut off after
+# MUSIC_ANALYSIS_TIMEOUT_SECONDS, and once MUSIC_ANALYSIS_MAX_QUEUE tasks are
+# waiting behind the busy workers new ones are refused with a 503.
+MUSIC_ANALYSIS_WORKERS = max(1, int(os.getenv("MUSIC_ANALYSIS_WORKERS", "0")) or min(os.cpu_count() or 1, 4))
+MUSIC_ANALYSIS_TIMEOUT_SECONDS = float(os.getenv("MUSIC_ANALYSIS_TIMEOUT_SECONDS", "120"))
+MUSIC_ANALYSIS_MAX_QUEUE = int(os.getenv("MUSIC_ANALYSIS_MAX_QUEUE", "8"))
+# "full" streams the whole track in fixed-size blocks; "preview" loads the first 60s
+MUSIC_ANALYSIS_MODES = ("full", "preview")
+MUSIC_ANALYSIS_MODE = os.getenv("MUSIC_ANALYSIS_MODE", "full")
+analysis_pool = None
+analysis_tasks = 0  # Submitted and not yet finished
+
+def analysis_task_finished() -> None:
+    """A pool task is over and its worker free again"""
+    global analysis_tasks
+    analysis_tasks -= 1
+    metrics["music_analysis_queue_depth"] = analysis_tasks
+
+def get_analysis_pool() -> ProcessPoolExecutor:
+    """Music analysis pool, started on first use"""
+    global analysis_pool
+    if analysis_pool is None:
+        analysis_pool = ProcessPoolExecutor(
+            max_workers=MUSIC_ANALYSIS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=audio_analysis.warm_up
+        )
+    return analysis_pool
+
+async def warm_analysis_pool():
+    """Start every analysis worker now so the first uploads don't pay for the warm-up"""
+    pool = get_analysis_pool()
+    loop = asyncio.get_running_loop()
+    for _ in range(MUSIC_ANALYSIS_WORKERS):
+        loop.run_in_executor(pool, time.sleep, 0)
+
+def shutdown_worker_pools():
+    """Stop the analysis and motion worker processes"""
+    for pool in (analysis_pool, motion_pool):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+async def run_music_analysis(function, *args) -> Any:
+    """Run an audio_analysis function in the pool without blocking the event loop.
+
+    Raises 503 when the queue is full and 504 when the task times out.
+    """
+    global analysis_pool, analysis_tasks
+    loop = asyncio.get_running_loop()
+    if analysis_tasks >= MUSIC_ANALYSIS_WORKERS + MUSIC_ANALYSIS_MAX_QUEUE:
+        metric_inc("music_analysis_rejected")
+        raise HTTPException(
+            status_code=503,
+            detail="Music analysis is busy, please retry shortly",
+            headers={"Retry-After": str(int(estimated_seconds("music_analysis_seconds")) + 1)}
+        )
+
+    analysis_tasks += 1
+    metrics["music_analysis_queue_depth"] = analysis_tasks
+    start = time.time()
     try:
-        # Save uploaded file temporarily
-        temp_dir = tempfile.mkdtemp()
-        file_path = os.path.join(temp_dir, file.filename)
-        
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        print(f"🎵 Analyzing music file: {file.filename}")
-        
-        # Try to use librosa for detailed analysis
         try:
-            import librosa
-            import numpy as np
-            
-            # Load audio
-            y, sr = librosa.load(file_path, duration=60)  # Analyze first 60 seconds
-            duration_full = librosa.get_duration(path=file_path)
-            
-            # Extract features
-            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-            
-            # Energy analysis
-            rms = librosa.feature.rms(y=y)[0]
-            energy_level = float(np.mean(rms))
-            
-            # Spectral features for mood
-            spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-            brightness = float(np.mean(spectral_centroid))
-            
-            # Detect key moments (beat frames)
-            onset_frames = librosa.onset.onset_detect(y=y, sr=sr)
-            onset_times = librosa.frames_to_time(onset_frames, sr=sr)
-            
-            # Select key moments (every 5-10 seconds)
-            key_moments = []
-            for t in onset_times:
-                if len(key_moments) == 0 or t - key_moments[-1] > 5:
-                    key_moments.append(float(t))
-                if len(key_moments) >= 8:
-                    break
-            
-            # Determine mood based on features
-            if tempo > 140:
-                mood = "energetic and upbeat"
-                genre = "electronic/dance"
-            elif tempo > 120:
-                mood = "lively and positive"
-                genre = "pop/rock"
-            elif tempo > 90:
-                mood = "moderate and balanced"
-                genre = "indie/alternative"
-            else:
-                mood = "calm and relaxed"
-                genre = "ambient/chill"
-            
-            if energy_level > 0.1:
-                energy = "high energy"
-            elif energy_level > 0.05:
-                energy = "medium energy"
-            else:
-                energy = "low energy"
-            
-            analysis = MusicAnalysis(
-                duration=float(duration_full),
-                tempo=float(tempo),
-                mood=mood,
-                energy=energy,
-                genre=genre,
-                key_moments=key_moments,
-                description=f"A {mood} {genre} track with {energy} at {int(tempo)} BPM"
+            future = get_analysis_pool().submit(
+                audio_analysis.run_with_timeout, MUSIC_ANALYSIS_TIMEOUT_SECONDS, function, *args
             )
+        except Exception:
+            analysis_task_finished()
+            raise
+        # Counted until the worker is done, even when this request stops
+        # waiting first (timeout, client gone); the callback runs in the pool's thread
+        future.add_done_callback(lambda _: loop.is_closed() or loop.call_soon_threadsafe(analysis_task_finished))
+        # The worker enforces the timeout itself; this only guards against a
+        # worker that cannot (no SIGALRM) or hangs, and includes queueing time
+        max_wait = MUSIC_ANALYSIS_TIMEOUT_SECONDS * (1 + MUSIC_ANALYSIS_MAX_QUEUE / MUSIC_ANALYSIS_WORKERS)
+        result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=max_wait)
+    except (TimeoutError, asyncio.TimeoutError):
+        metric_inc("music_analysis_timeouts")
+        raise HTTPException(status_code=504, detail=f"Music analysis timed out after {MUSIC_ANALYSIS_TIMEOUT_SECONDS:.0f}s")
+    except BrokenProcessPool:
+        analysis_pool = None  # A worker died; start a fresh pool for the next request
+        raise
+    metric_observe("music_analysis_seconds", time.time() - start)
+    return result
+
+# ============================================================================
+# MUSIC ANALYSIS CACHE
+# ============================================================================
+
+# Analyses are kept on disk under the SHA-256 of the audio bytes (hashed while
+# the upload is written), so re-uploading a track - e.g. for analysis and
+# again for the music video - never analyzes it twice. Each entry is a
+# directory holding analysis_<mode>.json (MusicAnalysis plus decoded-duration
+# metadata), features_<mode>.npz (per-frame onset envelope/RMS/centroid,
+# beat and onset times) and waveform_<mode>.bin (the waveform peak pyramid as
+# raw little-endian int16 min/max pairs, levels back to back, so one level is
+# a single seek and read). Directory mtime is the LRU timestamp.
+ANALYSIS_CACHE_DIR = os.path.join(GENERATED_VIDEOS_DIR, "analysis_cache")
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_MB", "512")) * 1024 * 1024
+ANALYSIS_CACHE_VERSION = 3  # Bump when analysis results change
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# A full-track analysis also answers preview requests, not the other way round
+ANALYSIS_CACHE_MODES = {"full": ["full"], "preview": ["preview", "full"]}
+AUDIO_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+def copy_and_hash(source, path: str) -> str:
+    """Copy a file object to path in chunks, returning the SHA-256 of its bytes"""
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        while chunk := source.read(UPLOAD_CHUNK_BYTES):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+async def save_upload(upload: UploadFile, path: str) -> str:
+    """Write an upload to path in one pass (one worker thread hop), returning its SHA-256"""
+    await upload.seek(0)
+    return await asyncio.to_thread(copy_and_hash, upload.file, path)
+
+class IngestedUpload:
+    """An upload spooled to a named file, with the SHA-256 of its bytes"""
+
+    def __init__(self, path: str, audio_id: str, filename: Optional[str]):
+        self.path = path
+        self.audio_id = audio_id
+        self.filename = filename
+        self.size = os.path.getsize(path)
+
+@asynccontextmanager
+async def ingest_upload(upload: UploadFile):
+    """Spool an upload once to a private temp file that decoders read in place.
+
+    The multipart parser's spool is an anonymous file, so pool workers and
+    FFmpeg need one named copy; it is hashed while written and deleted on
+    exit, whether or not the handler succeeds. The client's filename only
+    contributes its extension (it is never used as a path).
+    """
+    suffix = os.path.splitext(os.path.basename(upload.filename or ""))[1][:16]
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix)
+    os.close(fd)
+    try:
+        audio_id = await save_upload(upload, path)
+        yield IngestedUpload(path, audio_id, upload.filename)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def analysis_cache_lookup(audio_id: str, mode: str = "preview") -> Optional[Dict[str, Any]]:
+    """Cached analysis entry for the audio (and mode), marking it recently used"""
+    directory = os.path.join(ANALYSIS_CACHE_DIR, audio_id)
+    for candidate in ANALYSIS_CACHE_MODES[mode]:
+        try:
+            with open(os.path.join(directory, f"analysis_{candidate}.json"), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if entry.get("version") != ANALYSIS_CACHE_VERSION:
+            continue
+        os.utime(directory)
+        return entry
+    return None
+
+def load_analysis_features(audio_id: str, mode: str) -> Optional[Dict[str, np.ndarray]]:
+    """Feature arrays stored with a cached analysis"""
+    try:
+        with np.load(os.path.join(ANALYSIS_CACHE_DIR, audio_id, f"features_{mode}.npz")) as data:
+            return {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        return None
+
+async def scene_starts(audio_id: Optional[str], count: int, duration: float) -> List[float]:
+    """Start times of count scenes: section boundaries of the analyzed track, else an even split"""
+    features = {}
+    if audio_id and AUDIO_ID_PATTERN.match(audio_id):
+        # A full-track analysis knows the sections of the whole file
+        entry = analysis_cache_lookup(audio_id, "full") or analysis_cache_lookup(audio_id, "preview")
+        if entry:
+            features = await asyncio.to_thread(load_analysis_features, audio_id, entry["mode"]) or {}
+    return await asyncio.to_thread(segmentation.boundaries, features, duration, count)
+
+def analysis_cache_store(audio_id: str, mode: str, result: Dict[str, Any], filename: Optional[str] = None) -> None:
+    """Persist an analyze_audio_file result and enforce the disk budget"""
+    directory = os.path.join(ANALYSIS_CACHE_DIR, audio_id)
+    features = result["features"]
+    levels, offset = [], 0
+    for peaks in result["waveform"]:
+        levels.append({"offset": offset, "peaks": len(peaks)})
+        offset += len(peaks)
+    entry = {
+        "version": ANALYSIS_CACHE_VERSION,
+        "audio_id": audio_id,
+        "mode": mode,
+        "filename": filename,
+        "analysis": result["analysis"],
+        "decoded_duration": result["decoded_duration"],
+        "feature_rate": float(features["frame_rate"]),
+        "feature_frames": int(len(features["onset_envelope"])),
+        "waveform": {
+            "sample_rate": audio_analysis.ANALYSIS_SAMPLE_RATE,
+            "samples_per_peak": waveform.PEAK_SAMPLES,
+            "level_factor": waveform.LEVEL_FACTOR,
+            "levels": levels,
+        },
+        "created_at": datetime.now().isoformat(),
+    }
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Features first: the JSON is what makes the entry visible
+        features_path = os.path.join(directory, f"features_{mode}.npz")
+        temp_path = os.path.join(directory, f"{uuid.uuid4().hex}.tmp.npz")
+        np.savez_compressed(temp_path, **features)
+        os.replace(temp_path, features_path)
+        waveform_path = os.path.join(directory, f"waveform_{mode}.bin")
+        temp_path = f"{waveform_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            for peaks in result["waveform"]:
+                f.write(peaks.astype("<i2").tobytes())
+        os.replace(temp_path, waveform_path)
+        analysis_path = os.path.join(directory, f"analysis_{mode}.json")
+        temp_path = f"{analysis_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, analysis_path)
+        evict_analysis_cache()
+    except OSError as e:
+        print(f"⚠️  Could not cache music analysis: {str(e)}")
+
+def evict_analysis_cache() -> None:
+    """Delete least recently used analyses until the cache fits its budget"""
+    entries = []
+    for name in os.listdir(ANALYSIS_CACHE_DIR):
+        path = os.path.join(ANALYSIS_CACHE_DIR, name)
+        if os.path.isdir(path):
+            entries.append((os.stat(path).st_mtime, directory_size(path), path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= ANALYSIS_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        print(f"🧹 Evicted cached analysis {os.path.basename(path)}")
+
+def resolve_analysis_mode(mode: Optional[str]) -> str:
+    """Requested analysis mode, or the configured default"""
+    mode = mode or MUSIC_ANALYSIS_MODE
+    if mode not in MUSIC_ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown analysis mode '{mode}' (use {' or '.join(MUSIC_ANALYSIS_MODES)})")
+    return mode
+
+async def analyze_audio_path(path: str, audio_id: str, mode: str, filename: Optional[str] = None) -> MusicAnalysis:
+    """Cached librosa analysis of an audio file, run in the analysis pool on a miss.
+
+    Raises ImportError when librosa is not installed.
+    """
+    cached = analysis_cache_lookup(audio_id, mode)
+    if cached:
+        metric_inc("music_analysis_cache_hits")
+        print(f"⚡ Music analysis cache hit for {filename}")
+        return MusicAnalysis(**cached["analysis"], audio_id=audio_id, cached=True)
+    
+    print(f"🎵 Analyzing music file: {filename}")
+    result = await run_music_analysis(audio_analysis.analyze_audio_file, path, mode == "full")
+    analysis = MusicAnalysis(**result["analysis"], audio_id=audio_id)
+    metric_inc("music_analysis_cache_misses")
+    await asyncio.to_thread(analysis_cache_store, audio_id, mode, result, filename)
+    return analysis
+
+@app.post("/api/music/analyze")
+async def analyze_music(file: UploadFile = File(...), mode: Optional[str] = Form(None)):
+    """Analyze uploaded music file for mood, tempo, and characteristics"""
+    mode = resolve_analysis_mode(mode)
+    try:
+        # Spool the upload once (hashing it on the way); the temp file is always removed
+        async with ingest_upload(file) as upload:
+            # Try to use librosa for detailed analysis (in the analysis pool)
+            try:
+                analysis = await analyze_audio_path(upload.path, upload.audio_id, mode, file.filename)
             
-        except ImportError:
-            # Fallback: Basic analysis without librosa
-            print("⚠️  librosa not available, using basic analysis")
-            
-            # Get file size and estimate duration
-            file_size = os.path.getsize(file_path)
-            estimated_duration = file_size / (128000 / 8)  # Assume 128kbps
-            
-            # Use Gemini for analysis if available
-            if gemini_model:
-                analysis_prompt = f"""Analyze this music file and provide characteristics:
+            except ImportError:
+                # Fallback: Basic analysis without librosa
+                print("⚠️  librosa not available, using basic analysis")
+                
+                # Get file size and estimate duration
+                file_size = upload.size
+                estimated_duration = file_size / (128000 / 8)  # Assume 128kbps
+                
+                # Use Gemini for analysis if available
+                if gemini_model:
+                    analysis_prompt = f"""Analyze this music file and provide characteristics:
                 
 Filename: {file.filename}
 File size: {file_size} bytes
@@ -2015,54 +3846,233 @@ Respond in JSON:
     "tempo": 120,
     "description": "brief description"
 }}"""
-                
-                response = gemini_model.generate_content(analysis_prompt)
-                text = response.text.strip()
-                
-                if text.startswith("```"):
-                    text = text.split("```")[1]
-                    if text.startswith("json"):
-                        text = text[4:]
-                text = text.strip()
-                
-                ai_analysis = json.loads(text)
-                
-                # Generate key moments evenly spaced
-                num_moments = min(8, int(estimated_duration / 5))
-                key_moments = [i * (estimated_duration / num_moments) for i in range(num_moments)]
-                
-                analysis = MusicAnalysis(
-                    duration=estimated_duration,
-                    tempo=ai_analysis.get("tempo", 120),
-                    mood=ai_analysis.get("mood", "balanced"),
-                    energy=ai_analysis.get("energy", "medium energy"),
-                    genre=ai_analysis.get("genre", "general"),
-                    key_moments=key_moments,
-                    description=ai_analysis.get("description", f"Music track from {file.filename}")
-                )
-            else:
-                # Ultimate fallback
-                key_moments = [i * 5.0 for i in range(min(8, int(estimated_duration / 5)))]
-                analysis = MusicAnalysis(
-                    duration=estimated_duration,
-                    tempo=120,
-                    mood="balanced",
-                    energy="medium energy",
-                    genre="general",
-                    key_moments=key_moments,
-                    description=f"Music track: {file.filename}"
-                )
-        
-        # Cleanup
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        
-        print(f"✅ Music analysis complete: {analysis.mood}, {analysis.tempo} BPM")
-        return analysis.model_dump()
+                    
+                    response = gemini_model.generate_content(analysis_prompt)
+                    text = response.text.strip()
+                    
+                    if text.startswith("```"):
+                        text = text.split("```")[1]
+                        if text.startswith("json"):
+                            text = text[4:]
+                    text = text.strip()
+                    
+                    ai_analysis = json.loads(text)
+                    
+                    # Generate key moments evenly spaced
+                    num_moments = min(8, int(estimated_duration / 5))
+                    key_moments = [i * (estimated_duration / num_moments) for i in range(num_moments)]
+                    
+                    analysis = MusicAnalysis(
+                        audio_id=upload.audio_id,
+                        duration=estimated_duration,
+                        tempo=ai_analysis.get("tempo", 120),
+                        mood=ai_analysis.get("mood", "balanced"),
+                        energy=ai_analysis.get("energy", "medium energy"),
+                        genre=ai_analysis.get("genre", "general"),
+                        key_moments=key_moments,
+                        description=ai_analysis.get("description", f"Music track from {file.filename}")
+                    )
+                else:
+                    # Ultimate fallback
+                    key_moments = [i * 5.0 for i in range(min(8, int(estimated_duration / 5)))]
+                    analysis = MusicAnalysis(
+                        audio_id=upload.audio_id,
+                        duration=estimated_duration,
+                        tempo=120,
+                        mood="balanced",
+                        energy="medium energy",
+                        genre="general",
+                        key_moments=key_moments,
+                        description=f"Music track: {file.filename}"
+                    )
+            
+            print(f"✅ Music analysis complete: {analysis.mood}, {analysis.tempo} BPM")
+            return analysis.model_dump()
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Music analysis error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Music analysis failed: {str(e)}")
 
+# Batch analysis: a playlist in one request, fanned out over the analysis pool
+MUSIC_BATCH_MAX_ITEMS = int(os.getenv("MUSIC_BATCH_MAX_ITEMS", "100"))
+
+def parse_artifact_ids(text: Optional[str]) -> List[str]:
+    """Artifact ids from a form field: a JSON list or comma-separated"""
+    if not text or not text.strip():
+        return []
+    try:
+        ids = json.loads(text)
+    except ValueError:
+        ids = text.split(",")
+    if isinstance(ids, str):
+        ids = [ids]
+    return [str(artifact_id).strip() for artifact_id in ids if str(artifact_id).strip()]
+
+async def analyze_batch_audio(item: Dict[str, Any], audio_id: str, mode: str, slots: asyncio.Semaphore) -> MusicAnalysis:
+    """Analyze one batch item, taking a pool slot only on a cache miss and waiting out a busy pool"""
+    if analysis_cache_lookup(audio_id, mode):
+        return await analyze_audio_path(item["path"], audio_id, mode, item["name"])
+    async with slots:
+        deadline = time.time() + MUSIC_ANALYSIS_TIMEOUT_SECONDS
+        while True:
+            try:
+                return await analyze_audio_path(item["path"], audio_id, mode, item["name"])
+            except HTTPException as e:
+                # Other requests filled the queue: retry rather than fail the item
+                if e.status_code != 503 or time.time() > deadline:
+                    raise
+                await asyncio.sleep(float((e.headers or {}).get("Retry-After", 1)))
+
+async def run_batch_item(
+    item: Dict[str, Any],
+    mode: str,
+    slots: asyncio.Semaphore,
+    shared: Dict[str, asyncio.Task]
+) -> Dict[str, Any]:
+    """One NDJSON line of a batch: the item's analysis or its error (never raises)"""
+    line = {"index": item["index"], "source": item["source"], "name": item["name"]}
+    try:
+        if item.get("error"):
+            raise item["error"]
+        audio_id = item.get("audio_id") or await asyncio.to_thread(file_sha256, item["path"])
+        # The same track twice in one batch is analyzed once
+        if audio_id not in shared:
+            shared[audio_id] = asyncio.ensure_future(analyze_batch_audio(item, audio_id, mode, slots))
+        analysis = await shared[audio_id]
+        line.update(status="ok", analysis=analysis.model_dump())
+    except HTTPException as e:
+        line.update(status="error", status_code=e.status_code, error=e.detail)
+    except ImportError:
+        line.update(status="error", status_code=501, error="librosa is not installed")
+    except Exception as e:
+        line.update(status="error", status_code=500, error=str(e))
+    if line["status"] == "error":
+        metric_inc("music_batch_item_errors")
+        print(f"   ⚠️  Batch item {item['name']} failed: {line['error']}")
+    return line
+
+async def stream_batch_analysis(items: List[Dict[str, Any]], mode: str):
+    """NDJSON lines in completion order, then a summary line"""
+    slots = asyncio.Semaphore(MUSIC_ANALYSIS_WORKERS)  # Leave queue room for single requests
+    shared: Dict[str, asyncio.Task] = {}
+    tasks = [asyncio.ensure_future(run_batch_item(item, mode, slots, shared)) for item in items]
+    start = time.time()
+    succeeded = 0
+    try:
+        for next_line in asyncio.as_completed(tasks):
+            line = await next_line
+            succeeded += line["status"] == "ok"
+            yield json.dumps(line) + "\n"
+        yield json.dumps({
+            "done": True,
+            "total": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded,
+            "seconds": round(time.time() - start, 3),
+        }) + "\n"
+        print(f"✅ Batch analysis complete: {succeeded}/{len(items)} tracks in {time.time() - start:.1f}s")
+    finally:
+        # Client went away (or we are done): stop waiting for the rest
+        for task in tasks + list(shared.values()):
+            task.cancel()
+
+@app.post("/api/music/analyze-batch")
+async def analyze_music_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    artifact_ids: Optional[str] = Form(None),
+    mode: Optional[str] = Form(None)
+):
+    """Analyze several tracks, streaming one NDJSON line per track as soon as it finishes"""
+    mode = resolve_analysis_mode(mode)
+    files = files or []
+    ids = parse_artifact_ids(artifact_ids)
+    if not files and not ids:
+        raise HTTPException(status_code=400, detail="Send one or more files or artifact_ids")
+    if len(files) + len(ids) > MUSIC_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MUSIC_BATCH_MAX_ITEMS} tracks per batch")
+    
+    print(f"🎵 Batch analysis of {len(files) + len(ids)} tracks ({mode})")
+    
+    # Uploads are closed when this handler returns, before the response streams,
+    # so spool them now; the stack deletes the temp files once the stream ends
+    uploads = AsyncExitStack()
+    items = []
+    try:
+        for file in files:
+            item = {"index": len(items), "source": "upload", "name": file.filename}
+            try:
+                upload = await uploads.enter_async_context(ingest_upload(file))
+                item.update(path=upload.path, audio_id=upload.audio_id)
+            except OSError as e:
+                item["error"] = HTTPException(status_code=500, detail=f"Could not read upload: {str(e)}")
+            items.append(item)
+        for artifact_id in ids:
+            item = {"index": len(items), "source": "artifact", "name": artifact_id}
+            try:
+                item["path"] = resolve_artifact_path(artifact_id)  # Analyzed in place
+            except HTTPException as e:
+                item["error"] = e
+            items.append(item)
+    except BaseException:
+        await uploads.aclose()
+        raise
+    
+    return StreamingResponse(
+        stream_batch_analysis(items, mode),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(uploads.aclose)
+    )
+
+WAVEFORM_FORMATS = {"int16": "<i2", "int8": "i1"}
+
+def read_waveform_level(audio_id: str, mode: str, level: Dict[str, int]) -> np.ndarray:
+    """One pyramid level from a cached waveform file, as (peaks, 2) int16 min/max pairs"""
+    with open(os.path.join(ANALYSIS_CACHE_DIR, audio_id, f"waveform_{mode}.bin"), "rb") as f:
+        f.seek(level["offset"] * 4)
+        data = f.read(level["peaks"] * 4)
+    return np.frombuffer(data, dtype="<i2").reshape(-1, 2)
+
+@app.get("/api/music/waveform/{audio_id}")
+async def get_music_waveform(audio_id: str, request: Request, level: int = 0, format: str = "int16"):
+    """Waveform peaks of an analyzed track at one zoom level, as raw interleaved min/max values"""
+    if not AUDIO_ID_PATTERN.match(audio_id):
+        raise HTTPException(status_code=404, detail="Unknown audio id")
+    if format not in WAVEFORM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown waveform format '{format}' (use {' or '.join(WAVEFORM_FORMATS)})")
+
+    # A full-track analysis covers the whole file; a preview one only its start
+    entry = analysis_cache_lookup(audio_id, "full") or analysis_cache_lookup(audio_id, "preview")
+    if not entry or not entry.get("waveform"):
+        raise HTTPException(status_code=404, detail="No waveform for this audio, analyze it first")
+    info = entry["waveform"]
+    if not 0 <= level < len(info["levels"]):
+        raise HTTPException(status_code=400, detail=f"Waveform level must be between 0 and {len(info['levels']) - 1}")
+
+    headers = {
+        "ETag": f'"{audio_id[:16]}-{ANALYSIS_CACHE_VERSION}-{entry["mode"]}-{level}-{format}"',
+        "Cache-Control": ARTIFACT_CACHE_CONTROL,
+        "X-Waveform-Level": str(level),
+        "X-Waveform-Levels": str(len(info["levels"])),
+        "X-Waveform-Peaks": str(info["levels"][level]["peaks"]),
+        "X-Waveform-Samples-Per-Peak": str(info["samples_per_peak"] * info["level_factor"] ** level),
+        "X-Waveform-Sample-Rate": str(info["sample_rate"]),
+        "X-Waveform-Format": format,
+        "X-Waveform-Mode": entry["mode"],
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        peaks = read_waveform_level(audio_id, entry["mode"], info["levels"][level])
+    except OSError:
+        raise HTTPException(status_code=404, detail="No waveform for this audio, analyze it first")
+    if format == "int8":
+        peaks = waveform.to_int8(peaks)
+    return Response(content=peaks.astype(WAVEFORM_FORMATS[format]).tobytes(), media_type="application/octet-stream", headers=headers)
+
 @app.post("/api/music/generate-story")
 async def generate_music_story(request: MusicStoryRequest):
     """Generate AI story and visual scenes based on music analysis"""
@@ -2119,6 +4129,12 @@ Focus on creating emotional, well-paced photo presentations!"""
         
         content_prompt = content_type_prompts.get(request.content_type, content_type_prompts["music-video"])
         
+        # Re-segment the analyzed track for the requested number of scenes
+        key_moments = request.key_moments
+        num_scenes = request.num_scenes or len(key_moments)
+        if (request.audio_id or request.num_scenes) and num_scenes > 0:
+            key_moments = await scene_starts(request.audio_id, num_scenes, request.duration)
+        
         story_prompt = f"""You are a creative director specializing in music videos. Create content for a music track with these characteristics:
 
 Duration: {request.duration:.1f} seconds
@@ -2128,8 +4144,9 @@ Energy: {request.energy}
 Genre: {request.genre}
 Description: {request.description}
 Content Type: {request.content_type}
+Scene start times: {", ".join(f"{moment:.1f}s" for moment in key_moments)}
 
-{content_prompt.format(num_scenes=len(request.key_moments))}
+{content_prompt.format(num_scenes=len(key_moments))}
 
 For each scene provide:
 - timestamp: when it appears in the music
@@ -2167,7 +4184,7 @@ Respond in JSON format:
         
         # Create timeline matching key moments
         timeline = []
-        for i, moment in enumerate(request.key_moments):
+        for i, moment in enumerate(key_moments):
             if i < len(story_data["scenes"]):
                 scene = story_data["scenes"][i]
                 scene["timestamp"] = moment
@@ -2191,6 +4208,27 @@ Respond in JSON format:
         print(f"❌ Story generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Story generation failed: {str(e)}")
 
+# Uploads are decoded straight from their spooled file; anything larger than
+# this (or with more pixels than CARTOON_MAX_PIXELS) is refused before decoding
+CARTOON_MAX_UPLOAD_BYTES = int(os.getenv("CARTOON_MAX_UPLOAD_MB", "20")) * 1024 * 1024
+CARTOON_MAX_PIXELS = 40_000_000  # ~8K x 5K
+
+def decode_upload_image(source) -> np.ndarray:
+    """BGR pixels of an uploaded image file, checking its dimensions before decoding"""
+    import cv2
+
+    try:
+        image = Image.open(source)  # Only reads the header so far
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Unsupported or corrupt image file")
+    with image:
+        if image.width * image.height > CARTOON_MAX_PIXELS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image too large ({image.width}x{image.height}), the limit is {CARTOON_MAX_PIXELS // 1_000_000} megapixels"
+            )
+        return cv2.cvtColor(np.asarray(ImageOps.exif_transpose(image).convert("RGB")), cv2.COLOR_RGB2BGR)
+
 @app.post("/api/music/cartoonize-image")
 async def cartoonize_image(
     file: UploadFile = File(...),
@@ -2200,22 +4238,21 @@ async def cartoonize_image(
     try:
         print(f"🎨 Cartoonizing image: {file.filename} in {style} style")
         
-        # Read image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Save temporarily
-        temp_dir = tempfile.mkdtemp()
-        input_path = os.path.join(temp_dir, "input.png")
-        image.save(input_path)
+        # The upload stays in its spooled file; check the size before touching the pixels
+        file.file.seek(0, os.SEEK_END)
+        if file.file.tell() > CARTOON_MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image too large, the limit is {CARTOON_MAX_UPLOAD_BYTES // (1024 * 1024)}MB"
+            )
+        file.file.seek(0)
         
         # Try OpenCV cartoon effect first (fast, local)
         try:
             import cv2
-            import numpy as np
             
-            # Read image
-            img = cv2.imread(input_path)
+            # Decoded by PIL from the spooled file, without a full in-memory copy of the upload
+            img = await asyncio.to_thread(decode_upload_image, file.file)
             
             # Apply cartoon effect based on style
             if style == "anime":
@@ -2253,20 +4290,14 @@ async def cartoonize_image(
                 cartoon = cv2.bilateralFilter(img, 9, 300, 300)
                 cartoon = cv2.edgePreservingFilter(cartoon, flags=1, sigma_s=60, sigma_r=0.4)
             
-            # Save result
-            output_path = os.path.join(temp_dir, "cartoon.png")
-            cv2.imwrite(output_path, cartoon)
-            
-            # Convert to base64
-            with open(output_path, "rb") as f:
-                cartoon_data = f.read()
+            # Encode result and convert to base64
+            ok, cartoon_data = cv2.imencode(".png", cartoon)
+            if not ok:
+                raise Exception("Could not encode cartoon image")
             
-            cartoon_base64 = base64.b64encode(cartoon_data).decode('utf-8')
+            cartoon_base64 = base64.b64encode(cartoon_data.tobytes()).decode('utf-8')
             cartoon_url = f"data:image/png;base64,{cartoon_base64}"
             
-            # Cleanup
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            
             print(f"✅ Image cartoonized using OpenCV {style} style")
             return {
                 "url": cartoon_url,
@@ -2280,8 +4311,9 @@ async def cartoonize_image(
             print("⚠️  OpenCV not available, using AI generation")
             
             # Fallback: Use BRIA AI to generate cartoon version
-            # First convert image to base64 URL
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
+            # First convert image to base64 URL (the upload is within CARTOON_MAX_UPLOAD_BYTES)
+            file.file.seek(0)
+            image_base64 = base64.b64encode(await asyncio.to_thread(file.file.read)).decode('utf-8')
             image_url = f"data:image/png;base64,{image_base64}"
             
             # Generate cartoon prompt
@@ -2312,9 +4344,6 @@ async def cartoonize_image(
             if not cartoon_url:
                 raise HTTPException(status_code=500, detail="Failed to generate cartoon image")
             
-            # Cleanup
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            
             print(f"✅ Image cartoonized using AI {style} style")
             return {
                 "url": cartoon_url,
@@ -2324,6 +4353,8 @@ async def cartoonize_image(
                 "height": 1024
             }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Cartoonization error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Image cartoonization failed: {str(e)}")
@@ -2332,11 +4363,17 @@ async def cartoonize_image(
 async def generate_music_video(
     music_file: UploadFile = File(...),
     story_json: str = Form(...),
-    cartoon_images: Optional[str] = Form(None)
+    cartoon_images: Optional[str] = Form(None),
+    render_profile: Optional[str] = Form(None),
+    two_phase: Optional[bool] = Form(None),
+    hls: Optional[bool] = Form(None)
 ):
     """Generate complete music video with story, images, and music"""
+    workspace = None
+    render_job = None  # Once set, the background render owns the workspace
     try:
         print(f"🎬 Generating music video...")
+        profile = get_render_profile(render_profile)
         
         # Parse inputs
         story_data = json.loads(story_json)
@@ -2347,22 +4384,16 @@ async def generate_music_video(
             cartoon_urls = json.loads(cartoon_images)
         
         # Create output directory
-        output_base = os.path.join(os.getcwd(), "generated_videos")
-        os.makedirs(output_base, exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        video_dir = os.path.join(output_base, f"music_video_{timestamp}")
-        os.makedirs(video_dir, exist_ok=True)
+        workspace = await JobWorkspace.create("music_video")
         
-        print(f"   📁 Created directory: {video_dir}")
+        print(f"   📁 Created directory: {workspace.dir}")
         
-        # Save music file
-        music_path = os.path.join(video_dir, "music.mp3")
-        with open(music_path, "wb") as f:
-            music_data = await music_file.read()
-            f.write(music_data)
+        # Save music file (its hash finds an earlier analysis of the same track)
+        music_path = workspace.scratch("music.mp3")
+        audio_id = await save_upload(music_file, music_path)
+        music_analysis = analysis_cache_lookup(audio_id, "full") or analysis_cache_lookup(audio_id, "preview")
         
-        print(f"   🎵 Saved music file")
+        print(f"   🎵 Saved music file" + (" (analysis cached)" if music_analysis else ""))
         
         # Generate images for each scene
         print(f"   🎨 Generating {len(story.scenes)} scene images...")
@@ -2424,7 +4455,7 @@ async def generate_music_video(
                     image_data = response.content
                 
                 # Save image
-                image_path = os.path.join(video_dir, f"scene_{i:04d}.png")
+                image_path = workspace.scratch(f"scene_{i:04d}.png")
                 with open(image_path, "wb") as f:
                     f.write(image_data)
                 
@@ -2432,66 +4463,44 @@ async def generate_music_video(
         
         print(f"   ✅ All scenes downloaded")
         
-        # Calculate timing for each scene
-        total_duration = story_data.get("duration", 30)
-        scene_duration = total_duration / len(scene_images)
+        # Calculate timing for each scene (the decoded track length if the story has none)
+        total_duration = story_data.get("duration") or (music_analysis["analysis"]["duration"] if music_analysis else 30)
+        # Scenes change at the track's section boundaries, on the beat (evenly without an analysis)
+        starts = await scene_starts(audio_id, len(scene_images), total_duration)
+        durations = [end - start for start, end in zip(starts, starts[1:] + [total_duration])]
         
         print(f"   🎬 Assembling video...")
         print(f"      Total duration: {total_duration}s")
         print(f"      Scenes: {len(scene_images)}")
-        print(f"      Duration per scene: {scene_duration:.2f}s")
-        
-        # Create concat file for FFmpeg
-        concat_file = os.path.join(video_dir, "concat.txt")
-        with open(concat_file, "w") as f:
-            for i in range(len(scene_images)):
-                f.write(f"file 'scene_{i:04d}.png'\n")
-                f.write(f"duration {scene_duration}\n")
-            # Repeat last frame
-            f.write(f"file 'scene_{len(scene_images)-1:04d}.png'\n")
-        
-        # Create video from images
-        video_no_audio = os.path.join(video_dir, "video_no_audio.mp4")
-        ffmpeg_video_cmd = [
-            "ffmpeg", "-y",
-            "-f", "concat",
-            "-safe", "0",
-            "-i", concat_file,
-            "-vf", "fps=30,scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2",
-            "-c:v", "libx264",
-            "-pix_fmt", "yuv420p",
-            "-preset", "fast",
-            video_no_audio
-        ]
-        
-        result = subprocess.run(ffmpeg_video_cmd, capture_output=True, text=True, cwd=video_dir)
-        if result.returncode != 0:
-            print(f"      ❌ FFmpeg video error: {result.stderr}")
-            raise Exception(f"Video creation failed: {result.stderr}")
-        
-        print(f"      ✅ Video created")
-        
-        # Add music to video
-        output_path = os.path.join(video_dir, "final_video.mp4")
-        ffmpeg_audio_cmd = [
-            "ffmpeg", "-y",
-            "-i", video_no_audio,
-            "-i", music_path,
-            "-c:v", "copy",
-            "-c:a", "aac",
-            "-shortest",
-            output_path
-        ]
-        
-        result = subprocess.run(ffmpeg_audio_cmd, capture_output=True, text=True, cwd=video_dir)
-        if result.returncode != 0:
-            print(f"      ❌ FFmpeg audio error: {result.stderr}")
-            raise Exception(f"Audio merge failed: {result.stderr}")
+        print(f"      Scene starts: {', '.join(f'{start:.1f}s' for start in starts)}")
+        
+        # Create video from images with the music muxed in the same pass
+        output_path = workspace.path("final_video.mp4")
+        image_files = [workspace.scratch(f"scene_{i:04d}.png") for i in range(len(scene_images))]
+        hls_url = None
+        hls = HLS_OUTPUT_DEFAULT if hls is None else hls
+        use_two_phase = TWO_PHASE_RENDER_DEFAULT if two_phase is None else two_phase
+        labels = [scene["description"] for scene in scene_images]
+        if use_two_phase:
+            previews = await create_video_previews(image_files, durations, labels, profile, workspace.dir)
+            render_job = await render_two_phase(
+                "music_video", image_files, durations, output_path, profile, music_path, workspace, hls
+            )
+            video_url = render_job["video_url"]
+        else:
+            _, previews = await asyncio.gather(
+                encode_slideshow(image_files, durations, output_path, profile, music_path, workspace.scratch_dir, hls),
+                create_video_previews(image_files, durations, labels, profile, workspace.dir)
+            )
+            workspace.finish()
+            video_url = artifact_url(output_path)
+            if hls:
+                hls_url = artifact_url(os.path.join(hls_dir_for(output_path), "index.m3u8"))
         
         print(f"      ✅ Music added to video")
         
         # Save story info
-        story_file = os.path.join(video_dir, "story.txt")
+        story_file = workspace.path("story.txt")
         with open(story_file, "w", encoding="utf-8") as f:
             f.write(f"Title: {story.title}\n\n")
             f.write(f"Story:\n{story.story}\n\n")
@@ -2503,27 +4512,31 @@ async def generate_music_video(
                 f.write(f"  Style: {scene['style']}\n")
                 f.write(f"  Action: {scene['action']}\n")
         
-        # Convert final video to base64
-        with open(output_path, "rb") as f:
-            video_data = f.read()
-        
-        video_base64 = base64.b64encode(video_data).decode('utf-8')
-        video_url = f"data:video/mp4;base64,{video_base64}"
-        
         print(f"   ✅ Music video complete!")
         print(f"   💾 Saved to: {output_path}")
         
         return {
             "video_url": video_url,
+            "artifact_id": artifact_id_for(output_path),
+            "render_job": render_job,
+            "hls_url": hls_url,
+            "previews": previews,
             "file_path": output_path,
+            "audio_id": audio_id,
             "title": story.title,
             "duration": total_duration,
             "scenes": len(scene_images),
             "story": story.story
         }
         
+    except HTTPException:
+        if workspace and render_job is None:
+            workspace.finish()
+        raise
     except Exception as e:
         print(f"❌ Music video generation error: {str(e)}")
+        if workspace and render_job is None:
+            workspace.finish()
         raise HTTPException(status_code=500, detail=f"Music video generation failed: {str(e)}")
 
 # ============================================================================
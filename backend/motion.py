@@ -0,0 +1,120 @@
+"""Ken Burns style camera motion for still keyframes.
+
+Each keyframe becomes a short clip: the camera movement text from the
+timeline ("slow zoom in", "tracking shot", ...) picks a pan/zoom preset, the
+per-frame affine matrices are computed up front with NumPy, OpenCV resamples
+the still with warpAffine and the frames are piped as raw video into FFmpeg.
+
+This module only depends on NumPy/OpenCV so process pool workers can import
+it quickly; main.py decides when to use a pool.
+"""
+import subprocess
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+# zoom at start/end and view centre at start/end (fractions of the image)
+MOTION_PRESETS = {
+    "static": {"zoom": (1.0, 1.0), "center": ((0.5, 0.5), (0.5, 0.5))},
+    "zoom_in": {"zoom": (1.0, 1.15), "center": ((0.5, 0.5), (0.5, 0.5))},
+    "zoom_out": {"zoom": (1.15, 1.0), "center": ((0.5, 0.5), (0.5, 0.5))},
+    "pan_left": {"zoom": (1.12, 1.12), "center": ((0.6, 0.5), (0.4, 0.5))},
+    "pan_right": {"zoom": (1.12, 1.12), "center": ((0.4, 0.5), (0.6, 0.5))},
+    "tilt_up": {"zoom": (1.12, 1.12), "center": ((0.5, 0.6), (0.5, 0.4))},
+    "tilt_down": {"zoom": (1.12, 1.12), "center": ((0.5, 0.4), (0.5, 0.6))},
+}
+DEFAULT_MOTION_PRESET = "zoom_in"  # Unrecognised movements still get a gentle push in
+
+# Checked in order, so the more specific phrases come first
+MOVEMENT_KEYWORDS = [
+    (("static", "locked", "still", "fixed"), "static"),
+    (("zoom out", "pull back", "pull out", "dolly out", "reveal"), "zoom_out"),
+    (("zoom in", "push in", "dolly in", "close in", "zoom"), "zoom_in"),
+    (("pan left", "track left", "tracking left", "truck left"), "pan_left"),
+    (("pan right", "track right", "tracking right", "truck right", "tracking", "pan", "truck"), "pan_right"),
+    (("tilt up", "crane up", "rise", "rising", "pedestal up"), "tilt_up"),
+    (("tilt down", "crane down", "descend", "pedestal down", "tilt"), "tilt_down"),
+]
+
+
+def motion_preset_for(camera_movement: Optional[str]) -> str:
+    """Map free-text camera movement from the timeline to a preset name"""
+    text = (camera_movement or "").lower()
+    for keywords, preset in MOVEMENT_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return preset
+    return DEFAULT_MOTION_PRESET
+
+
+def motion_matrices(preset: str, frames: int, source_size, output_size) -> np.ndarray:
+    """Affine matrices (frames x 2 x 3) mapping the source image onto each output frame"""
+    params = MOTION_PRESETS[preset]
+    source_width, source_height = source_size
+    width, height = output_size
+
+    # Eased progress so the move starts and ends gently
+    t = np.linspace(0.0, 1.0, frames) if frames > 1 else np.zeros(1)
+    t = t * t * (3 - 2 * t)
+
+    zoom = params["zoom"][0] + (params["zoom"][1] - params["zoom"][0]) * t
+    scale = max(width / source_width, height / source_height) * zoom  # Cover the frame, then zoom
+
+    (x0, y0), (x1, y1) = params["center"]
+    center_x = (x0 + (x1 - x0) * t) * source_width
+    center_y = (y0 + (y1 - y0) * t) * source_height
+
+    # Keep the visible window inside the image
+    half_width, half_height = width / 2 / scale, height / 2 / scale
+    center_x = np.clip(center_x, half_width, source_width - half_width)
+    center_y = np.clip(center_y, half_height, source_height - half_height)
+
+    matrices = np.zeros((len(t), 2, 3), dtype=np.float64)
+    matrices[:, 0, 0] = scale
+    matrices[:, 1, 1] = scale
+    matrices[:, 0, 2] = width / 2 - scale * center_x
+    matrices[:, 1, 2] = height / 2 - scale * center_y
+    return matrices
+
+
+def render_motion_segment(
+    image_file: str,
+    preset: str,
+    frames: int,
+    width: int,
+    height: int,
+    fps: int,
+    output_args: List[str],
+    segment_path: str
+) -> None:
+    """Render one keyframe's camera move and encode it with FFmpeg (runs in a worker)"""
+    image = cv2.imread(image_file, cv2.IMREAD_COLOR)
+    if image is None:
+        raise Exception(f"Could not read image {image_file}")
+
+    # Downscale once with area filtering so per-frame bilinear sampling does not alias
+    max_zoom = max(MOTION_PRESETS[preset]["zoom"])
+    prescale = max(width / image.shape[1], height / image.shape[0]) * max_zoom
+    if prescale < 1:
+        image = cv2.resize(image, None, fx=prescale, fy=prescale, interpolation=cv2.INTER_AREA)
+
+    matrices = motion_matrices(preset, frames, (image.shape[1], image.shape[0]), (width, height))
+
+    # Errors only: stderr is read after all frames are written, so it must not fill the pipe
+    ffmpeg_cmd = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-nostats",
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-framerate", str(fps), "-i", "-",
+    ] + output_args + [segment_path]
+    process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    try:
+        for matrix in matrices:
+            cv2.warpAffine(image, matrix, (width, height), dst=frame, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+            process.stdin.write(frame.data)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass  # FFmpeg exited early; its error is reported below
+    stderr = process.stderr.read().decode(errors="replace")
+    if process.wait() != 0:
+        raise Exception(f"FFmpeg failed: {stderr[-2000:]}")
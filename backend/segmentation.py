@@ -0,0 +1,156 @@
+"""Structural segmentation: beat-aligned scene boundaries from analysis features.
+
+The cached per-frame features (chroma, RMS, spectral centroid) are averaged
+per beat, a beat-level self-similarity matrix is scored with a Gaussian
+checkerboard kernel (Foote novelty) and its peaks mark section changes.
+boundaries() turns them into any number of scene start times: one boundary
+near each of the evenly spaced positions, at the strongest section change
+within reach or else on the nearest beat, so scenes cover the whole track
+instead of bunching up where the onsets are.
+
+Only depends on NumPy: analysis workers compute the default key moments
+with it and main.py re-segments cached features for other scene counts.
+"""
+from typing import Any, Dict, List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MAX_SEGMENTS = 8  # Default scene count for a long track
+MIN_SEGMENT_SECONDS = 5.0  # ... and at least this long per scene
+KERNEL_BEATS = 16  # Novelty compares the 16 beats before and after each beat (~8s at 120 BPM)
+PEAK_WINDOW_BEATS = 4  # A peak is the highest novelty within this many beats
+MAX_SSM_BEATS = 2048  # Longer tracks use every 2nd (3rd, ...) beat, bounding the matrix
+ZONE_REACH = 0.35  # How far (in scene lengths) a boundary may move from its even position
+DEFAULT_BEAT_PERIOD = 0.5  # Grid for audio without detected beats
+
+
+def segment_count(duration: float) -> int:
+    """Default number of scenes for a track"""
+    return min(MAX_SEGMENTS, max(1, int(duration // MIN_SEGMENT_SECONDS)))
+
+
+def beat_grid(beat_times, duration: float) -> np.ndarray:
+    """Detected beats, continued at their median period up to duration (e.g. past a preview)"""
+    beats = np.asarray(beat_times, dtype=np.float64).reshape(-1)
+    beats = np.unique(beats[(beats >= 0) & (beats < duration)])
+    period = float(np.median(np.diff(beats))) if len(beats) > 1 else DEFAULT_BEAT_PERIOD
+    period = max(period, 0.1)
+    start = beats[-1] + period if len(beats) else 0.0
+    return np.concatenate([beats, np.arange(start, duration, period)])
+
+
+def beat_features(features: Dict[str, Any], beats: np.ndarray) -> np.ndarray:
+    """(dims, beats) standardized mean feature vectors between consecutive beats.
+
+    Only beats inside the analyzed frames get a column.
+    """
+    rms = np.asarray(features["rms"], dtype=np.float64)
+    frames = len(rms)
+    rows = [
+        20 * np.log10(rms + 1e-5)[None, :],  # Loudness (dB)
+        np.asarray(features["centroid"], dtype=np.float64)[None, :],  # Brightness
+    ]
+    chroma = features.get("chroma")
+    if chroma is not None and np.size(chroma):
+        chroma = np.asarray(chroma, dtype=np.float64)
+        rows.append(chroma / np.maximum(chroma.max(axis=0, keepdims=True), 1e-6))
+    X = np.vstack(rows)
+
+    starts = np.rint((beats - float(features["frame_offset"])) * float(features["frame_rate"])).astype(int)
+    starts = np.clip(starts, 0, None)
+    starts = starts[starts < frames]
+    if len(starts) == 0:
+        return np.zeros((X.shape[0], 0))
+    sums = np.add.reduceat(X, starts, axis=1)
+    counts = np.diff(np.append(starts, frames))
+    means = sums / np.maximum(counts, 1)
+
+    # Equal say for loudness, brightness and (all 12 bins of) harmony
+    means = (means - means.mean(axis=1, keepdims=True)) / (means.std(axis=1, keepdims=True) + 1e-6)
+    if means.shape[0] > 2:
+        means[2:] /= np.sqrt(means.shape[0] - 2)
+    return means
+
+
+def checkerboard_kernel(half: int) -> np.ndarray:
+    """Gaussian-tapered checkerboard: +1 within the past/future blocks, -1 across them"""
+    offsets = np.arange(-half, half) + 0.5
+    taper = np.sign(offsets) * np.exp(-0.5 * (offsets / (0.5 * half)) ** 2)
+    return np.outer(taper, taper)
+
+
+def novelty_curve(X: np.ndarray, half: int = KERNEL_BEATS) -> np.ndarray:
+    """Foote novelty per column of X: how much the columns before it differ from those after"""
+    count = X.shape[1]
+    half = min(half, count // 2)
+    if half < 1:
+        return np.zeros(count)
+    unit = X / np.maximum(np.linalg.norm(X, axis=0, keepdims=True), 1e-9)
+    ssm = unit.T @ unit  # Cosine self-similarity
+    padded = np.pad(ssm, half)
+    index = np.arange(count)
+    windows = sliding_window_view(padded, (2 * half, 2 * half))[index, index]  # Centred on each diagonal entry
+    return np.maximum(np.einsum("nij,ij->n", windows, checkerboard_kernel(half)), 0.0)
+
+
+def pick_peaks(curve: np.ndarray, window: int = PEAK_WINDOW_BEATS) -> np.ndarray:
+    """Indices of local maxima that stand above the local mean"""
+    if len(curve) == 0:
+        return np.zeros(0, dtype=int)
+    padded = np.pad(curve, window, constant_values=-np.inf)
+    local_max = sliding_window_view(padded, 2 * window + 1).max(axis=1)
+    local_mean = np.convolve(curve, np.ones(2 * window + 1) / (2 * window + 1), mode="same")
+    return np.flatnonzero((curve >= local_max) & (curve > local_mean) & (curve > 0))
+
+
+def beat_novelty(features: Dict[str, Any], beats: np.ndarray) -> np.ndarray:
+    """Novelty of a section change at each beat (0 past the analyzed audio)"""
+    novelty = np.zeros(len(beats))
+    if not features or "rms" not in features:
+        return novelty
+    step = -(-len(beats) // MAX_SSM_BEATS)  # Ceiling division
+    columns = beats[::step]
+    X = beat_features(features, columns)
+    if X.shape[1]:
+        novelty[::step][:X.shape[1]] = novelty_curve(X, max(1, KERNEL_BEATS // step))
+    return novelty
+
+
+def boundaries(features: Dict[str, Any], duration: float, count: int) -> List[float]:
+    """count scene start times: 0.0, then count - 1 beat-aligned section boundaries.
+
+    features are analysis feature arrays (see audio_analysis.feature_arrays);
+    empty features give an even split.
+    """
+    if count <= 0 or duration <= 0:
+        return []
+    beat_times = features.get("beat_times", []) if features else []
+    beats = beat_grid(beat_times, duration)
+    spacing = duration / count
+    targets = np.arange(1, count) * spacing
+    if len(targets) == 0:
+        return [0.0]
+
+    # Fallback for each target: the nearest beat, if it is within reach
+    result = targets.copy()
+    if len(beats):
+        index = np.searchsorted(beats, targets)
+        before = beats[np.clip(index - 1, 0, len(beats) - 1)]
+        after = beats[np.clip(index, 0, len(beats) - 1)]
+        snapped = np.where(np.abs(after - targets) < np.abs(before - targets), after, before)
+        result = np.where(np.abs(snapped - targets) <= ZONE_REACH * spacing, snapped, targets)
+
+    # The strongest novelty peak within reach of a target replaces it
+    novelty = beat_novelty(features, beats)
+    peaks = pick_peaks(novelty)
+    if len(peaks):
+        times = beats[peaks]
+        zone = np.rint(times / spacing).astype(int)
+        valid = (zone >= 1) & (zone < count) & (np.abs(times - zone * spacing) <= ZONE_REACH * spacing)
+        times, zone, strength = times[valid], zone[valid], novelty[peaks][valid]
+        order = np.lexsort((-strength, zone))
+        zones, first = np.unique(zone[order], return_index=True)
+        result[zones - 1] = times[order][first]
+
+    return [0.0] + [round(float(t), 3) for t in result]
@@ -0,0 +1,74 @@
+"""Min/max waveform peak pyramids for drawing audio on the timeline.
+
+Level 0 holds one (min, max) pair per PEAK_SAMPLES decoded samples, as int16;
+each further level halves the resolution by merging neighbouring pairs, down
+to MIN_LEVEL_PEAKS pairs. The frontend picks the level closest to its zoom
+(one pair per pixel column) instead of decoding the audio itself.
+
+Only depends on NumPy: analysis workers build the pyramid while they decode,
+main.py stores and serves it.
+"""
+from typing import List
+
+import numpy as np
+
+PEAK_SAMPLES = 256  # Level 0: ~86 pairs per second at 22.05kHz
+LEVEL_FACTOR = 2
+MIN_LEVEL_PEAKS = 64
+
+
+def quantize(samples) -> np.ndarray:
+    """float samples in [-1, 1] to int16"""
+    return np.round(np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def block_peaks(samples, samples_per_peak: int = PEAK_SAMPLES) -> np.ndarray:
+    """(n, 2) int16 min/max of consecutive samples_per_peak windows (the last may be short)"""
+    samples = np.asarray(samples, dtype=np.float32)
+    whole = len(samples) - len(samples) % samples_per_peak
+    windows = samples[:whole].reshape(-1, samples_per_peak)
+    peaks = [np.stack([windows.min(axis=1), windows.max(axis=1)], axis=1)]
+    if whole < len(samples):
+        rest = samples[whole:]
+        peaks.append(np.array([[rest.min(), rest.max()]], dtype=np.float32))
+    return quantize(np.concatenate(peaks))
+
+
+class PeakAccumulator:
+    """Level 0 peaks over consecutive (non-overlapping) chunks of samples"""
+
+    def __init__(self, samples_per_peak: int = PEAK_SAMPLES):
+        self.samples_per_peak = samples_per_peak
+        self.blocks: List[np.ndarray] = []
+        self.remainder = np.zeros(0, dtype=np.float32)
+
+    def add(self, samples) -> None:
+        samples = np.concatenate([self.remainder, np.asarray(samples, dtype=np.float32)])
+        whole = len(samples) - len(samples) % self.samples_per_peak
+        if whole:
+            self.blocks.append(block_peaks(samples[:whole], self.samples_per_peak))
+        self.remainder = samples[whole:]
+
+    def peaks(self) -> np.ndarray:
+        blocks = self.blocks
+        if len(self.remainder):
+            blocks = blocks + [block_peaks(self.remainder, self.samples_per_peak)]
+        return np.concatenate(blocks) if blocks else np.zeros((0, 2), dtype=np.int16)
+
+
+def peak_pyramid(base) -> List[np.ndarray]:
+    """All levels, finest first, each LEVEL_FACTOR times coarser than the last"""
+    levels = [np.asarray(base, dtype=np.int16).reshape(-1, 2)]
+    while len(levels[-1]) > MIN_LEVEL_PEAKS:
+        peaks = levels[-1]
+        padding = -len(peaks) % LEVEL_FACTOR
+        if padding:
+            peaks = np.concatenate([peaks, np.repeat(peaks[-1:], padding, axis=0)])
+        groups = peaks.reshape(-1, LEVEL_FACTOR, 2)
+        levels.append(np.stack([groups[:, :, 0].min(axis=1), groups[:, :, 1].max(axis=1)], axis=1))
+    return levels
+
+
+def to_int8(peaks) -> np.ndarray:
+    """Halve the payload for drawing: keep the high byte of each int16 value"""
+    return (np.asarray(peaks, dtype=np.int16) >> 8).astype(np.int8)
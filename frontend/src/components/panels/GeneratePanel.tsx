@@ -4,10 +4,10 @@ import { Button } from "@/components/ui/button";
 import { Slider } from "@/components/ui/slider";
 import { Input } from "@/components/ui/input";
 import { useVideoStore } from "@/store/videoStore";
-import { convertToStructuredPrompt, generateFromStructured } from "@/lib/bria-api";
+import { convertToStructuredPrompt, generateFromStructured, generateImage, StructuredPrompt } from "@/lib/bria-api";
 import { useToast } from "@/hooks/use-toast";
 import GeneratedContentInfo from "./GeneratedContentInfo";
-import { buildApiUrl, API_ENDPOINTS } from "@/config/api";
+import { buildApiUrl, resolveApiUrl, fetchApiFile, API_ENDPOINTS } from "@/config/api";
 
 const styles = [
   "Cinematic",
@@ -40,6 +40,13 @@ const GeneratePanel = () => {
     rewritten: string;
     editable: string;
   }>>([]);
+  // Plan from the prompt preview, reused by the video generate call
+  const [videoPlan, setVideoPlan] = useState<{
+    token: string;
+    prompt: string;
+    structuredPrompt: StructuredPrompt;
+    style: string;
+  } | null>(null);
   
   // Music integration
   const [musicFile, setMusicFile] = useState<File | null>(null);
@@ -100,7 +107,7 @@ const GeneratePanel = () => {
       const response = await fetch(buildApiUrl(API_ENDPOINTS.MUSIC_DOWNLOAD_YOUTUBE), {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ url: youtubeUrl }),
+        body: JSON.stringify({ url: youtubeUrl, include_audio_data: false }),
       });
 
       if (!response.ok) {
@@ -110,16 +117,8 @@ const GeneratePanel = () => {
 
       const result = await response.json();
       
-      // Convert base64 to File object
-      const audioData = result.audio_data.split(',')[1];
-      const byteCharacters = atob(audioData);
-      const byteNumbers = new Array(byteCharacters.length);
-      for (let i = 0; i < byteCharacters.length; i++) {
-        byteNumbers[i] = byteCharacters.charCodeAt(i);
-      }
-      const byteArray = new Uint8Array(byteNumbers);
-      const blob = new Blob([byteArray], { type: 'audio/mp3' });
-      const file = new File([blob], `${result.title}.mp3`, { type: 'audio/mp3' });
+      // Fetch the cached audio as-is (usually m4a, not mp3)
+      const file = await fetchApiFile(result.audio_url, result.title);
       
       setMusicFile(file);
       setYoutubeInfo({ title: result.title, duration: result.duration });
@@ -178,6 +177,29 @@ const GeneratePanel = () => {
     }
   };
 
+  // Structured prompt for the current prompt, converting it on first use
+  const ensureStructuredPrompt = async () => {
+    let finalStructuredPrompt = structuredPrompt;
+    if (!finalStructuredPrompt && prompt.trim()) {
+      setGenerationProgress("Converting prompt to structured JSON...");
+      const convertResult = await convertToStructuredPrompt(prompt, seed);
+      finalStructuredPrompt = convertResult.structured_prompt;
+      setStructuredPrompt(finalStructuredPrompt);
+    }
+
+    if (!finalStructuredPrompt) {
+      throw new Error("Failed to generate structured prompt");
+    }
+    return finalStructuredPrompt;
+  };
+
+  // Inject style into the structured prompt
+  const withStyle = (base: StructuredPrompt): StructuredPrompt => ({
+    ...base,
+    artistic_style: style,
+    style_medium: style === "Animated" ? "Digital illustration" : "Photography",
+  });
+
   // Preview video prompts
   const handlePreviewPrompts = async () => {
     if (!prompt.trim()) {
@@ -202,10 +224,16 @@ const GeneratePanel = () => {
     setGenerationError(null);
 
     try {
+      // Preview the styled prompt so its plan matches what generate will send
+      const baseStructuredPrompt = await ensureStructuredPrompt();
       setGenerationProgress("Analyzing prompt and generating frame descriptions...");
       
       const { previewVideoPrompts } = await import("@/lib/bria-api");
-      const preview = await previewVideoPrompts(prompt, { seed, aspect_ratio: aspectRatio });
+      const preview = await previewVideoPrompts(prompt, {
+        structured_prompt: withStyle(baseStructuredPrompt),
+        seed,
+        aspect_ratio: aspectRatio,
+      });
       
       // Convert to editable format
       const editablePrompts = preview.frames.map((frame: any) => ({
@@ -217,6 +245,9 @@ const GeneratePanel = () => {
       
       setRewrittenPrompts(editablePrompts);
       setShowRewrittenPrompts(true);
+      setVideoPlan(preview.plan_token
+        ? { token: preview.plan_token, prompt, structuredPrompt: baseStructuredPrompt, style }
+        : null);
       
       toast({
         title: "Prompts Generated!",
@@ -252,37 +283,38 @@ const GeneratePanel = () => {
     setGeneratedImageUrl(null);
 
     try {
-      // If no structured prompt yet, convert first
-      let finalStructuredPrompt = structuredPrompt;
-      if (!finalStructuredPrompt && prompt.trim()) {
-        setGenerationProgress("Converting prompt to structured JSON...");
-        const convertResult = await convertToStructuredPrompt(prompt, seed);
-        finalStructuredPrompt = convertResult.structured_prompt;
-        setStructuredPrompt(finalStructuredPrompt);
-      }
-
-      if (!finalStructuredPrompt) {
-        throw new Error("Failed to generate structured prompt");
-      }
+      // A previewed video plan skips the Gemini planning, as long as the styled prompt is unchanged
+      let result;
+      if (
+        selectedContentType === "video" && videoPlan && videoPlan.prompt === prompt
+        && videoPlan.structuredPrompt === structuredPrompt && videoPlan.style === style
+      ) {
+        setGenerationProgress("Generating frames from the previewed plan...");
+        result = await generateImage({
+          structured_prompt: withStyle(videoPlan.structuredPrompt),
+          plan_token: videoPlan.token,
+          seed,
+          steps_num: stepsNum,
+          aspect_ratio: aspectRatio,
+          guidance_scale: guidanceScale,
+          force_category: "video",
+        });
+      } else {
+        // If no structured prompt yet, convert first
+        const enhancedPrompt = withStyle(await ensureStructuredPrompt());
 
-      // Inject style into the structured prompt
-      const enhancedPrompt = {
-        ...finalStructuredPrompt,
-        artistic_style: style,
-        style_medium: style === "Animated" ? "Digital illustration" : "Photography",
-      };
+        setGenerationProgress("Submitting to BRIA API...");
 
-      setGenerationProgress("Submitting to BRIA API...");
-      
-      const result = await generateFromStructured(enhancedPrompt, {
-        seed,
-        steps_num: stepsNum,
-        aspect_ratio: aspectRatio,
-        guidance_scale: guidanceScale,
-        force_category: selectedContentType,
-        tailored_model_id: tailoredModelId || undefined,
-        image_url: imageUrl || undefined,
-      });
+        result = await generateFromStructured(enhancedPrompt, {
+          seed,
+          steps_num: stepsNum,
+          aspect_ratio: aspectRatio,
+          guidance_scale: guidanceScale,
+          force_category: selectedContentType,
+          tailored_model_id: tailoredModelId || undefined,
+          image_url: imageUrl || undefined,
+        });
+      }
       
       if (selectedContentType === "video") {
         setGenerationProgress("Creating video timeline and generating frames... (this may take 2-3 minutes)");
@@ -296,7 +328,8 @@ const GeneratePanel = () => {
       console.log("Result.image?.url:", result.image?.url);
 
       // Check if we have an image URL in any format
-      const resultImageUrl = result.image?.url || result.url || result.result_url;
+      const rawImageUrl = result.image?.url || result.url || result.result_url;
+      const resultImageUrl = rawImageUrl ? resolveApiUrl(rawImageUrl) : rawImageUrl;
       
       if (resultImageUrl) {
         console.log("Setting image URL:", resultImageUrl);
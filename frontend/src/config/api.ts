@@ -64,6 +64,22 @@ export const buildApiUrl = (endpoint: string): string => {
   return `${getApiBaseUrl()}${endpoint}`;
 };
 
+// Backend media (e.g. /api/artifacts/...) may come back as a relative URL
+export const resolveApiUrl = (url: string): string => {
+  return url.startsWith('/') ? buildApiUrl(url) : url;
+};
+
+// Download backend media as a File, keeping the artifact's own extension and content type
+export const fetchApiFile = async (url: string, baseName: string): Promise<File> => {
+  const response = await fetch(resolveApiUrl(url));
+  if (!response.ok) {
+    throw new Error(`Failed to download ${baseName} (status ${response.status})`);
+  }
+  const blob = await response.blob();
+  const extension = new URL(url, window.location.href).pathname.match(/\.(\w+)$/)?.[1] || 'bin';
+  return new File([blob], `${baseName}.${extension}`, { type: blob.type });
+};
+
 // Helper function for making API calls with consistent error handling
 export const apiCall = async (endpoint: string, options: RequestInit = {}): Promise<Response> => {
   const url = buildApiUrl(endpoint);
@@ -55,6 +55,7 @@ export interface BriaGenerateRequest {
   image_url?: string;
   force_category?: string;  // Manual category override: "image", "video", "ads", "tailored", "image-to-video"
   tailored_model_id?: string;  // For tailored models
+  plan_token?: string;  // From previewVideoPrompts: reuse the previewed video plan
 }
 
 export interface BriaImage {
@@ -154,6 +155,7 @@ export async function generateImage(
         force_category: request.force_category,
         tailored_model_id: request.tailored_model_id,
         image_url: request.image_url,
+        plan_token: request.plan_token,
       }),
     });
 
@@ -208,7 +210,7 @@ export async function generateFromStructured(
 // Preview video prompts before generation
 export async function previewVideoPrompts(
   prompt: string,
-  options: Omit<BriaGenerateRequest, "prompt" | "structured_prompt"> = {}
+  options: Omit<BriaGenerateRequest, "prompt"> = {}
 ): Promise<any> {
   try {
     const response = await fetch(`${getApiUrl()}/api/preview-video-prompts`, {
@@ -218,6 +220,7 @@ export async function previewVideoPrompts(
       },
       body: JSON.stringify({
         prompt,
+        structured_prompt: options.structured_prompt,
         seed: options.seed,
         aspect_ratio: options.aspect_ratio,
         force_category: "video",
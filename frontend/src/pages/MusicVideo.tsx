@@ -8,7 +8,7 @@ import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs";
 import { Progress } from "@/components/ui/progress";
 import { toast } from "sonner";
 import { Music, Image as ImageIcon, Video, Sparkles, Upload, Download, Loader2 } from "lucide-react";
-import { buildApiUrl, API_ENDPOINTS } from "@/config/api";
+import { buildApiUrl, resolveApiUrl, fetchApiFile, API_ENDPOINTS } from "@/config/api";
 
 interface MusicAnalysis {
   duration: number;
@@ -82,7 +82,7 @@ export default function MusicVideo() {
       const response = await fetch(buildApiUrl(API_ENDPOINTS.MUSIC_DOWNLOAD_YOUTUBE), {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ url: youtubeUrl }),
+        body: JSON.stringify({ url: youtubeUrl, include_audio_data: false }),
       });
 
       if (!response.ok) {
@@ -93,16 +93,8 @@ export default function MusicVideo() {
       const result = await response.json();
       setProgress(50);
       
-      // Convert base64 to File object
-      const audioData = result.audio_data.split(',')[1];
-      const byteCharacters = atob(audioData);
-      const byteNumbers = new Array(byteCharacters.length);
-      for (let i = 0; i < byteCharacters.length; i++) {
-        byteNumbers[i] = byteCharacters.charCodeAt(i);
-      }
-      const byteArray = new Uint8Array(byteNumbers);
-      const blob = new Blob([byteArray], { type: 'audio/mp3' });
-      const file = new File([blob], `${result.title}.mp3`, { type: 'audio/mp3' });
+      // Fetch the cached audio as-is (usually m4a, not mp3)
+      const file = await fetchApiFile(result.audio_url, result.title);
       
       setMusicFile(file);
       setProgress(100);
@@ -141,7 +133,7 @@ export default function MusicVideo() {
       setProgress(90);
       const result = await response.json();
       
-      setFinalVideo(result.video_url);
+      setFinalVideo(resolveApiUrl(result.video_url));
       setVideoInfo(result);
       setProgress(100);
       toast.success("Lyric video created!");
@@ -271,7 +263,7 @@ export default function MusicVideo() {
       if (!response.ok) throw new Error("Failed to generate video");
 
       const result = await response.json();
-      setFinalVideo(result.video_url);
+      setFinalVideo(resolveApiUrl(result.video_url));
       setVideoInfo(result);
       setProgress(100);
       toast.success("Music video created!");